@@ -8,6 +8,8 @@ from pathlib import Path
 
 logger = logging.getLogger(__name__.rpartition(".")[0])
 
+_read_size = 64 * 1024
+
 
 def run_captured(
     args, *popen_args, file=sys.stdout, **popen_kwargs
@@ -20,8 +22,10 @@ def run_captured(
         stderr=subprocess.STDOUT,
         **popen_kwargs,
     ) as process:
-        for c in iter(lambda: process.stdout.read(1), b""):
-            file.buffer.write(c)
+        # unbuffered reads return as soon as any output is available
+        for chunk in iter(lambda: process.stdout.read(_read_size), b""):
+            file.buffer.write(chunk)
+            file.buffer.flush()
         process.wait()
     return subprocess.CompletedProcess(
         process.args, process.returncode, process.stdout, process.stderr
@@ -1,6 +1,7 @@
 import logging
 import os
 import re
+from io import BytesIO
 from os import PathLike
 from pathlib import Path
 from typing import List, Optional, Sequence, Union
@@ -12,14 +13,36 @@ import tifffile
 from ._steinbock import SteinbockException
 
 logger = logging.getLogger(__name__)
-img_dtype = np.dtype(os.environ.get("STEINBOCK_IMG_DTYPE", "float32"))
-mask_dtype = np.dtype(os.environ.get("STEINBOCK_MASK_DTYPE", "uint16"))
 
 
 class SteinbockIOException(SteinbockException):
     pass
 
 
+def _check_tiff_compression(compression: Optional[str]) -> Optional[str]:
+    if not compression:
+        return None
+    # some codecs are only available if the optional imagecodecs package is
+    # installed, so compress a single pixel to check for codec availability
+    try:
+        tifffile.imwrite(
+            BytesIO(), data=np.zeros((1, 1), dtype=np.uint8), compression=compression
+        )
+    except Exception as e:
+        raise SteinbockIOException(
+            f"Unsupported TIFF compression {compression} "
+            f"(STEINBOCK_TIFF_COMPRESSION): {e}"
+        )
+    return compression
+
+
+img_dtype = np.dtype(os.environ.get("STEINBOCK_IMG_DTYPE", "float32"))
+mask_dtype = np.dtype(os.environ.get("STEINBOCK_MASK_DTYPE", "uint16"))
+tiff_compression = _check_tiff_compression(
+    os.environ.get("STEINBOCK_TIFF_COMPRESSION")  # e.g. "zlib"
+)
+
+
 def _as_path_with_suffix(path: Union[str, PathLike], suffix: str) -> Path:
     path = Path(path)
     if re.fullmatch(r".+\.ome\.[^.]+", path.name, flags=re.IGNORECASE):
@@ -52,6 +75,42 @@ def _to_dtype(src: np.ndarray, dst_dtype: np.dtype) -> np.ndarray:
     return src.astype(dst_dtype)
 
 
+def _write_compressed_tiff(tiff_file: Union[str, PathLike], data: np.ndarray) -> None:
+    # tiles are compressed in parallel; ImageJ hyperstacks do not support this
+    tifffile.imwrite(
+        tiff_file,
+        data=data,
+        bigtiff=True,
+        photometric="minisblack",
+        tile=(512, 512),
+        compression=tiff_compression,
+        maxworkers=os.cpu_count(),
+    )
+
+
+def _mmap_tiff(tiff_file: Union[str, PathLike], mode: str, **kwargs) -> np.ndarray:
+    try:
+        return tifffile.memmap(tiff_file, mode=mode, **kwargs)
+    except ValueError:
+        # compressed TIFF files are not memory-mappable
+        if mode != "r":
+            raise
+        logger.debug("Reading non-memory-mappable file %s into memory", tiff_file)
+        return tifffile.imread(tiff_file, squeeze=False)
+
+
+def _get_csv_sep(csv_file: Union[str, PathLike]) -> Optional[str]:
+    # steinbock accepts both "," and ";" as CSV separators; returns None if
+    # the separator cannot be determined unambiguously from the header line
+    with Path(csv_file).open(newline="") as f:
+        header = f.readline()
+    if ";" not in header:
+        return ","
+    if "," not in header:
+        return ";"
+    return None
+
+
 def _list_related_files(
     base_files: Sequence[Union[str, PathLike]],
     related_dir: Union[str, PathLike],
@@ -71,15 +130,16 @@ def _list_related_files(
 def read_panel(
     panel_file: Union[str, PathLike], unfiltered: bool = False
 ) -> pd.DataFrame:
+    sep = _get_csv_sep(panel_file)
     panel = pd.read_csv(
         panel_file,
-        sep=",|;",
+        sep=sep or ",|;",
         dtype={
             "channel": pd.StringDtype(),
             "name": pd.StringDtype(),
             "keep": pd.BooleanDtype(),
         },
-        engine="python",
+        engine="python" if sep is None else "c",
         true_values=["1"],
         false_values=["0"],
     )
@@ -169,7 +229,7 @@ def mmap_image(img_file: Union[str, PathLike], mode="r", **kwargs) -> np.ndarray
     if "imagej" not in kwargs and mode == "r+":
         kwargs["imagej"] = True
     img_exists = Path(img_file).exists()
-    img = tifffile.memmap(img_file, mode=mode, **kwargs)
+    img = _mmap_tiff(img_file, mode, **kwargs)
     if img_exists:
         if img.dtype != img_dtype:
             logger.warning(
@@ -189,6 +249,9 @@ def write_image(
 ) -> None:
     if not ignore_dtype:
         img = _to_dtype(img, img_dtype)
+    if tiff_compression is not None:
+        _write_compressed_tiff(img_file, img)
+        return
     tifffile.imwrite(
         img_file,
         data=img[np.newaxis, np.newaxis, :, :, :, np.newaxis],
@@ -197,16 +260,17 @@ def write_image(
 
 
 def read_image_info(image_info_file: Union[str, PathLike]) -> pd.DataFrame:
+    sep = _get_csv_sep(image_info_file)
     image_info = pd.read_csv(
         image_info_file,
-        sep=",|;",
+        sep=sep or ",|;",
         dtype={
             "image": pd.StringDtype(),
             "width_px": pd.UInt16Dtype(),
             "height_px": pd.UInt16Dtype(),
             "num_channels": pd.UInt8Dtype(),
         },
-        engine="python",
+        engine="python" if sep is None else "c",
     )
     for required_col in ("image", "width_px", "height_px", "num_channels"):
         if required_col not in image_info:
@@ -299,7 +363,7 @@ def mmap_mask(mask_file: Union[str, PathLike], mode="r", **kwargs) -> np.ndarray
     if "imagej" not in kwargs and mode == "r+":
         kwargs["imagej"] = True
     mask_exists = Path(mask_file).exists()
-    mask = tifffile.memmap(mask_file, mode=mode, **kwargs)
+    mask = _mmap_tiff(mask_file, mode, **kwargs)
     if mask_exists:
         if mask.dtype != mask_dtype:
             logger.warning(
@@ -319,6 +383,9 @@ def write_mask(
 ) -> None:
     if not ignore_dtype:
         mask = _to_dtype(mask, mask_dtype)
+    if tiff_compression is not None:
+        _write_compressed_tiff(mask_file, mask)
+        return
     tifffile.imwrite(
         mask_file,
         data=mask[np.newaxis, np.newaxis, np.newaxis, :, :, np.newaxis],
@@ -336,7 +403,13 @@ def list_data_files(
 
 
 def read_data(data_file: Union[str, PathLike]) -> pd.DataFrame:
-    return pd.read_csv(data_file, sep=",|;", index_col="Object", engine="python")
+    sep = _get_csv_sep(data_file)
+    return pd.read_csv(
+        data_file,
+        sep=sep or ",|;",
+        index_col="Object",
+        engine="python" if sep is None else "c",
+    )
 
 
 def write_data(data: pd.DataFrame, data_file: Union[str, PathLike]) -> None:
@@ -354,16 +427,17 @@ def list_neighbors_files(
 
 
 def read_neighbors(neighbors_file: Union[str, PathLike]) -> pd.DataFrame:
+    sep = _get_csv_sep(neighbors_file)
     return pd.read_csv(
         neighbors_file,
-        sep=",|;",
+        sep=sep or ",|;",
         usecols=["Object", "Neighbor", "Distance"],
         dtype={
             "Object": mask_dtype,
             "Neighbor": mask_dtype,
             "Distance": np.float32,
         },
-        engine="python",
+        engine="python" if sep is None else "c",
     )
 
 
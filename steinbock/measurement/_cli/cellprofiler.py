@@ -1,5 +1,8 @@
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Tuple
 
 import click
 import click_log
@@ -78,7 +81,8 @@ def prepare_cmd(
     img_files = io.list_image_files(img_dir)
     mask_files = io.list_mask_files(mask_dir, base_files=img_files)
     Path(cpdata_dir).mkdir(exist_ok=True)
-    for img_file, mask_file in zip(img_files, mask_files):
+
+    def prepare_image_and_mask(img_file: Path, mask_file: Path) -> Tuple[Path, Path]:
         img = io.read_image(img_file, native_dtype=True)
         cp_img = io._to_dtype(img, np.uint16)[
             np.newaxis, np.newaxis, :, :, :, np.newaxis
@@ -89,8 +93,7 @@ def prepare_cmd(
             data=cp_img,
             imagej=cp_img.dtype in (np.uint8, np.uint16, np.float32),
         )
-        logger.info(cp_img_file)
-        del img
+        del img, cp_img
         mask = io.read_mask(mask_file, native_dtype=True)
         cp_mask = io._to_dtype(mask, np.uint16)[
             np.newaxis, np.newaxis, np.newaxis, :, :, np.newaxis
@@ -101,8 +104,17 @@ def prepare_cmd(
             data=cp_mask,
             imagej=cp_mask.dtype in (np.uint8, np.uint16, np.float32),
         )
-        logger.info(cp_mask_file)
-        del mask
+        del mask, cp_mask
+        return cp_img_file, cp_mask_file
+
+    # image I/O and conversion mostly release the GIL; the number of threads
+    # is limited, as each thread holds one image in memory
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        for cp_img_file, cp_mask_file in executor.map(
+            prepare_image_and_mask, img_files, mask_files
+        ):
+            logger.info(cp_img_file)
+            logger.info(cp_mask_file)
     cellprofiler.create_and_save_measurement_pipeline(
         measurement_pipeline_file, len(panel.index)
     )
@@ -1,9 +1,9 @@
 import logging
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
 from os import PathLike
 from pathlib import Path
-from typing import Generator, Optional, Sequence, Tuple, Union
+from typing import Callable, Generator, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -21,7 +21,34 @@ class SteinbockNeighborsMeasurementException(SteinbockMeasurementException):
     pass
 
 
+@lru_cache(maxsize=1)
+def _get_gpu_expand_labels() -> Optional[Callable[[np.ndarray, float], np.ndarray]]:
+    # imported and probed lazily, as probing for GPUs initializes the CUDA
+    # runtime, which must not happen for commands that do not need it
+    try:
+        import cupy as cp
+        from cucim.skimage.segmentation import expand_labels
+
+        if cp.cuda.runtime.getDeviceCount() == 0:
+            return None
+    except Exception:
+        return None
+
+    def gpu_expand_labels(mask: np.ndarray, dmax: float) -> np.ndarray:
+        return cp.asnumpy(expand_labels(cp.asarray(mask), distance=float(dmax)))
+
+    return gpu_expand_labels
+
+
 def _expand_mask_euclidean(mask: np.ndarray, dmax: float) -> np.ndarray:
+    if dmax <= 0:
+        # background pixels are never within a distance of zero to any object
+        return mask
+    gpu_expand_labels = _get_gpu_expand_labels()
+    if gpu_expand_labels is not None:
+        # background pixels equidistant to multiple objects may be assigned to
+        # a different object than by the CPU implementation below
+        return gpu_expand_labels(mask, dmax)
     dists, (i, j) = distance_transform_edt(mask == 0, return_indices=True)
     return np.where(dists <= dmax, mask[i, j], mask)
 
@@ -175,6 +175,13 @@ def panel_cmd(
     type=click.FLOAT,
     help="Hot pixel filter (specify delta threshold)",
 )
+@click.option(
+    "--jobs",
+    "max_workers",
+    type=click.IntRange(min=1),
+    help="Number of images preprocessed in parallel "
+    "[default: number of available CPUs, at most 8]",
+)
 @click.option(
     "--imgout",
     "img_dir",
@@ -193,7 +200,9 @@ def panel_cmd(
 )
 @click_log.simple_verbosity_option(logger=steinbock_logger)
 @catch_exception(handle=SteinbockException)
-def images_cmd(mcd_dir, txt_dir, unzip, panel_file, hpf, img_dir, image_info_file):
+def images_cmd(
+    mcd_dir, txt_dir, unzip, panel_file, hpf, max_workers, img_dir, image_info_file
+):
     channel_names = None
     if Path(panel_file).exists():
         panel = io.read_panel(panel_file)
@@ -212,7 +221,12 @@ def images_cmd(mcd_dir, txt_dir, unzip, panel_file, hpf, img_dir, image_info_fil
         recovery_txt_file,
         recovered,
     ) in imc.try_preprocess_images_from_disk(
-        mcd_files, txt_files, channel_names=channel_names, hpf=hpf, unzip=unzip
+        mcd_files,
+        txt_files,
+        channel_names=channel_names,
+        hpf=hpf,
+        unzip=unzip,
+        max_workers=max_workers,
     ):
         img_file_stem = Path(mcd_or_txt_file).stem
         if acquisition is not None:
@@ -1,11 +1,19 @@
 import logging
+import multiprocessing
+import os
 import re
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from os import PathLike
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Any, Dict, Generator, List, Optional, Sequence, Tuple, Union
 from zipfile import ZipFile
 
+import cv2
 import numpy as np
 import pandas as pd
 from scipy.ndimage import maximum_filter
@@ -21,8 +29,20 @@ try:
 except Exception:
     imc_available = False
 
+try:
+    from numba import njit, prange, set_num_threads
+
+    numba_available = True
+except Exception:
+    numba_available = False
+
 
 logger = logging.getLogger(__name__)
+_zip_extract_buffer_size = 8 * 1024 * 1024
+_max_pending_images = 8
+_max_filter_threads: Optional[int] = None
+_float32_buffer = threading.local()
+_txt_file_name_suffix_pattern = re.compile(r"_(?P<acquisition_id>[0-9]+)\.txt$")
 
 
 class SteinbockIMCPreprocessingException(SteinbockPreprocessingException):
@@ -37,6 +57,18 @@ def _get_zip_file_member(path: Union[str, PathLike]) -> Optional[Tuple[Path, str
     return None
 
 
+def _extract_zip_file_member(
+    fzip: ZipFile, member: str, dest_dir: Union[str, PathLike]
+) -> Path:
+    extracted_file = Path(dest_dir) / Path(member).name
+    with fzip.open(member) as fsrc:
+        with open(
+            extracted_file, mode="wb", buffering=_zip_extract_buffer_size
+        ) as fdst:
+            shutil.copyfileobj(fsrc, fdst, length=_zip_extract_buffer_size)
+    return extracted_file
+
+
 def list_mcd_files(mcd_dir: Union[str, PathLike], unzip: bool = False) -> List[Path]:
     mcd_files = sorted(Path(mcd_dir).rglob("[!.]*.mcd"))
     if unzip:
@@ -66,7 +98,8 @@ def _clean_panel(panel: pd.DataFrame) -> pd.DataFrame:
         inplace=True,
     )
     name_dupl_mask = panel["name"].duplicated(keep=False)
-    name_suffixes = panel.groupby("name").cumcount().map(lambda i: f" {i + 1}")
+    name_numbers = panel.groupby("name", dropna=False).cumcount() + 1
+    name_suffixes = " " + name_numbers.astype(str)
     panel.loc[name_dupl_mask, "name"] += name_suffixes[name_dupl_mask]
     if "keep" not in panel:
         panel["keep"] = pd.Series(dtype=pd.BooleanDtype())
@@ -93,16 +126,17 @@ def create_panel_from_imc_panel(
     imc_panel_keep_col: str = "full",
     imc_panel_ilastik_col: str = "ilastik",
 ) -> pd.DataFrame:
+    sep = io._get_csv_sep(imc_panel_file)
     imc_panel = pd.read_csv(
         imc_panel_file,
-        sep=",|;",
+        sep=sep or ",|;",
         dtype={
             imc_panel_channel_col: pd.StringDtype(),
             imc_panel_name_col: pd.StringDtype(),
             imc_panel_keep_col: pd.BooleanDtype(),
             imc_panel_ilastik_col: pd.BooleanDtype(),
         },
-        engine="python",
+        engine="python" if sep is None else "c",
         true_values=["1"],
         false_values=["0"],
     )
@@ -132,13 +166,15 @@ def create_panel_from_imc_panel(
         if panel_col in imc_panel.columns and panel_col != imc_panel_col
     ]
     panel = imc_panel.drop(columns=drop_columns).rename(columns=rename_columns)
-    for _, g in panel.groupby("channel"):
-        panel.loc[g.index, "name"] = " / ".join(g["name"].dropna().unique())
-        if "keep" in panel:
-            panel.loc[g.index, "keep"] = g["keep"].any()
-        if "ilastik" in panel:
-            panel.loc[g.index, "ilastik"] = g["ilastik"].any()
-    panel = panel.groupby(panel["channel"].values).aggregate("first")
+    channel_groups = panel.groupby(panel["channel"].values)
+    channel_names = channel_groups["name"].aggregate(
+        lambda names: " / ".join(names.dropna().unique())
+    )
+    panel = channel_groups.aggregate("first")
+    panel["name"] = channel_names.astype(pd.StringDtype())
+    for bool_col in ("keep", "ilastik"):
+        if bool_col in panel:
+            panel[bool_col] = channel_groups[bool_col].any().astype(pd.BooleanDtype())
     panel = _clean_panel(panel)  # ilastik column may be nullable uint8 now
     ilastik_mask = panel["ilastik"].fillna(False).astype(bool)
     panel["ilastik"] = pd.Series(dtype=pd.UInt8Dtype())
@@ -179,7 +215,9 @@ def create_panel_from_mcd_files(
             zip_file, mcd_member = zip_file_mcd_member
             with ZipFile(zip_file) as fzip:
                 with TemporaryDirectory() as temp_dir:
-                    extracted_mcd_file = fzip.extract(mcd_member, path=temp_dir)
+                    extracted_mcd_file = _extract_zip_file_member(
+                        fzip, mcd_member, temp_dir
+                    )
                     panels += create_panels_from_mcd_file(extracted_mcd_file)
     panel = pd.concat(panels, ignore_index=True, copy=False)
     panel.drop_duplicates(inplace=True, ignore_index=True)
@@ -209,7 +247,9 @@ def create_panel_from_txt_files(
             zip_file, txt_member = zip_file_txt_member
             with ZipFile(zip_file) as fzip:
                 with TemporaryDirectory() as temp_dir:
-                    extracted_txt_file = fzip.extract(txt_member, path=temp_dir)
+                    extracted_txt_file = _extract_zip_file_member(
+                        fzip, txt_member, temp_dir
+                    )
                     panel = create_panel_from_txt_file(extracted_txt_file)
                     panels.append(panel)
     panel = pd.concat(panels, ignore_index=True, copy=False)
@@ -253,20 +293,137 @@ def create_image_info(
     return image_info_row
 
 
-def filter_hot_pixels(img: np.ndarray, thres: float) -> np.ndarray:
-    kernel = np.ones((1, 3, 3), dtype=bool)
-    kernel[0, 1, 1] = False
-    max_neighbor_img = maximum_filter(img, footprint=kernel, mode="mirror")
-    return np.where(img - max_neighbor_img > thres, max_neighbor_img, img)
+# data types supported by cv2.dilate
+_cv2_dilate_dtypes = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def _max_neighbor_filter(img: np.ndarray) -> np.ndarray:
+    if img.dtype not in _cv2_dilate_dtypes:
+        kernel = np.ones((1, 3, 3), dtype=bool)
+        kernel[0, 1, 1] = False
+        return maximum_filter(img, footprint=kernel, mode="mirror")
+    # 8-neighborhood, excluding the center pixel
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    kernel[1, 1] = 0
+    img = np.ascontiguousarray(img)
+    max_neighbor_img = np.empty_like(img)
+
+    def dilate_channel(channel_index: int) -> None:
+        # BORDER_REFLECT_101 corresponds to scipy's mode="mirror"
+        cv2.dilate(
+            img[channel_index],
+            kernel,
+            dst=max_neighbor_img[channel_index],
+            borderType=cv2.BORDER_REFLECT_101,
+        )
+
+    if _max_filter_threads == 1:
+        for channel_index in range(img.shape[0]):
+            dilate_channel(channel_index)
+        return max_neighbor_img
+    # cv2 releases the GIL, so channels can be processed concurrently
+    with ThreadPoolExecutor(max_workers=_max_filter_threads) as executor:
+        for _ in executor.map(dilate_channel, range(img.shape[0])):
+            pass
+    return max_neighbor_img
+
+
+if numba_available:
+
+    @njit(parallel=True, cache=True)
+    def _filter_hot_pixels_numba(img, thres, out):
+        num_channels, height, width = img.shape
+        for i in prange(num_channels * height):
+            c = i // height
+            y = i % height
+            # index clamping equivalent to scipy's mode="mirror"
+            y0 = y - 1 if y > 0 else min(1, height - 1)
+            y1 = y + 1 if y < height - 1 else max(height - 2, 0)
+            for x in range(width):
+                x0 = x - 1 if x > 0 else min(1, width - 1)
+                x1 = x + 1 if x < width - 1 else max(width - 2, 0)
+                m = img[c, y0, x0]
+                m = max(m, img[c, y0, x])
+                m = max(m, img[c, y0, x1])
+                m = max(m, img[c, y, x0])
+                m = max(m, img[c, y, x1])
+                m = max(m, img[c, y1, x0])
+                m = max(m, img[c, y1, x])
+                m = max(m, img[c, y1, x1])
+                v = img[c, y, x]
+                out[c, y, x] = m if v - m > thres else v
+
+
+def filter_hot_pixels(
+    img: np.ndarray, thres: float, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    if numba_available and img.ndim == 3 and img.dtype in (np.float32, np.float64):
+        filtered_img = out
+        if out is None or np.shares_memory(out, img):
+            filtered_img = np.empty_like(img)
+        _filter_hot_pixels_numba(img, img.dtype.type(thres), filtered_img)
+        if out is not None and filtered_img is not out:
+            np.copyto(out, filtered_img)
+            return out
+        return filtered_img
+    max_neighbor_img = _max_neighbor_filter(img)
+    # np.minimum(img, max_neighbor_img + thres) is not equivalent to the mask
+    # below, as hot pixels would be set to max_neighbor_img + thres
+    if out is not None and not np.shares_memory(out, img):
+        diff_img = np.subtract(img, max_neighbor_img, out=out)  # scratch space
+    else:
+        diff_img = np.subtract(img, max_neighbor_img)
+    hot_pixel_mask = np.greater(diff_img, thres)
+    del diff_img
+    if out is None:
+        # reuse the neighborhood maximum buffer for the filtered image
+        np.logical_not(hot_pixel_mask, out=hot_pixel_mask)
+        np.copyto(max_neighbor_img, img, where=hot_pixel_mask)
+        return max_neighbor_img
+    if out is not img:
+        np.copyto(out, img)
+    np.copyto(out, max_neighbor_img, where=hot_pixel_mask)
+    return out
+
+
+def _get_float32_buffer(shape: Tuple[int, ...]) -> np.ndarray:
+    # a single buffer per thread (preprocess_image may be called from multiple
+    # threads), grown to the largest image and reused for images of any shape
+    size = int(np.prod(shape))
+    buf = getattr(_float32_buffer, "buf", None)
+    if buf is None or buf.size < size:
+        _float32_buffer.buf = None  # release the old buffer before allocating
+        buf = _float32_buffer.buf = np.empty(size, dtype=np.float32)
+    return buf[:size].reshape(shape)
 
 
 def preprocess_image(img: np.ndarray, hpf: Optional[float] = None) -> np.ndarray:
-    img = img.astype(np.float32)
     if hpf is not None:
+        if img.dtype != np.float32:
+            # filter_hot_pixels allocates its result, so the float32 copy of
+            # the input can be reused for subsequent images
+            buf = _get_float32_buffer(img.shape)
+            np.copyto(buf, img, casting="unsafe")
+            img = buf
         img = filter_hot_pixels(img, hpf)
+    else:
+        img = img.astype(np.float32, copy=False)
     return io._to_dtype(img, io.img_dtype)
 
 
+def _select_channels(
+    img: np.ndarray, channel_ind: List[int], reuse_buffer: bool = False
+) -> np.ndarray:
+    # the selected image is written to the float32 buffer of the current thread
+    # and only valid until the buffer is used next, so reusing the buffer is
+    # only safe if the selected image is not returned by preprocess_image,
+    # i.e. if hot pixel filtering is enabled
+    if reuse_buffer and img.dtype == np.float32:
+        buf = _get_float32_buffer((len(channel_ind),) + img.shape[1:])
+        return np.take(img, channel_ind, axis=0, out=buf)
+    return img[channel_ind, :, :]
+
+
 def _get_channel_indices(
     acquisition: AcquisitionBase, channel_names: Sequence[str]
 ) -> Union[List[int], str]:
@@ -278,18 +435,35 @@ def _get_channel_indices(
     return channel_indices
 
 
+def _index_txt_files(
+    txt_files: Sequence[Union[str, PathLike]],
+) -> Dict[int, Dict[Union[str, PathLike], str]]:
+    # maps acquisition IDs to txt files and their file name prefixes
+    txt_file_index = {}
+    for txt_file in txt_files:
+        txt_file_name = Path(txt_file).name
+        m = _txt_file_name_suffix_pattern.search(txt_file_name)
+        if m is not None:
+            acquisition_id = int(m.group("acquisition_id"))
+            txt_file_name_prefix = txt_file_name[: m.start()]
+            txt_file_index.setdefault(acquisition_id, {})[
+                txt_file
+            ] = txt_file_name_prefix
+    return txt_file_index
+
+
 def _match_txt_file(
     mcd_file: Union[str, PathLike],
     acquisition: Acquisition,
-    txt_files: Sequence[Union[str, PathLike]],
+    txt_file_index: Dict[int, Dict[Union[str, PathLike], str]],
 ) -> Union[str, PathLike, None]:
-    txt_file_name_pattern = re.compile(
-        rf"{Path(mcd_file).stem}.*_0*{acquisition.id}.txt"
-    )
+    mcd_file_stem = Path(mcd_file).stem
     filtered_txt_files = [
         txt_file
-        for txt_file in txt_files
-        if txt_file_name_pattern.match(Path(txt_file).name)
+        for txt_file, txt_file_name_prefix in txt_file_index.get(
+            acquisition.id, {}
+        ).items()
+        if txt_file_name_prefix.startswith(mcd_file_stem)
     ]
     if len(filtered_txt_files) == 1:
         return filtered_txt_files[0]
@@ -297,7 +471,7 @@ def _match_txt_file(
         logger.warning(
             "Ambiguous txt file matching for %s: %s; continuing without a match",
             mcd_file,
-            ", ".join(filtered_txt_files),
+            ", ".join(str(txt_file) for txt_file in filtered_txt_files),
         )
     return None
 
@@ -319,7 +493,7 @@ def _try_preprocess_txt_image_from_disk(
                     return None
             img = f.read_acquisition()
         if channel_ind is not None:
-            img = img[channel_ind, :, :]
+            img = _select_channels(img, channel_ind, reuse_buffer=hpf is not None)
         img = preprocess_image(img, hpf=hpf)
         return img
     except Exception as e:
@@ -327,80 +501,93 @@ def _try_preprocess_txt_image_from_disk(
         return None
 
 
-def _try_preprocess_mcd_images_from_disk(
+def _try_unzip_and_preprocess_txt_image_from_disk(
+    txt_file: Union[str, PathLike],
+    channel_names: Optional[Sequence[str]] = None,
+    hpf: Optional[float] = None,
+    unzip: bool = False,
+) -> Optional[Tuple[np.ndarray, bool]]:
+    zip_file_txt_member = _get_zip_file_member(txt_file)
+    if zip_file_txt_member is None:
+        img = _try_preprocess_txt_image_from_disk(
+            txt_file, channel_names=channel_names, hpf=hpf
+        )
+        if img is not None:
+            return img, False
+    elif unzip:
+        zip_file, txt_member = zip_file_txt_member
+        with ZipFile(zip_file) as fzip:
+            with TemporaryDirectory() as temp_dir:
+                extracted_txt_file = _extract_zip_file_member(
+                    fzip, txt_member, temp_dir
+                )
+                img = _try_preprocess_txt_image_from_disk(
+                    extracted_txt_file, channel_names=channel_names, hpf=hpf
+                )
+                if img is not None:
+                    return img, False
+    return None
+
+
+def _try_preprocess_mcd_acquisition_from_disk(
     mcd_file: Union[str, PathLike],
-    candidate_txt_files: List[Union[str, PathLike]],
+    acquisition_id: int,
+    channel_ind: Optional[List[int]] = None,
+    recovery_txt_file: Union[str, PathLike, None] = None,
     channel_names: Optional[Sequence[str]] = None,
     hpf: Optional[float] = None,
     unzip: bool = False,
-) -> Generator[Tuple[Acquisition, np.ndarray, Optional[Path], bool], None, None]:
+) -> Optional[Tuple[np.ndarray, bool]]:
     try:
         with MCDFile(mcd_file) as f_mcd:
-            for slide in f_mcd.slides:
-                for acquisition in slide.acquisitions:
-                    recovery_txt_file = _match_txt_file(
-                        mcd_file, acquisition, candidate_txt_files
-                    )
-                    if recovery_txt_file is not None:
-                        candidate_txt_files.remove(recovery_txt_file)
-                        recovery_txt_file = Path(recovery_txt_file)
-                    channel_ind = None
-                    if channel_names is not None:
-                        channel_ind = _get_channel_indices(acquisition, channel_names)
-                        if isinstance(channel_ind, str):
-                            logger.warning(
-                                f"Channel {channel_ind} not found for acquisition "
-                                f"{acquisition.id} in file {mcd_file}; skipping"
-                            )
-                            continue
-                    try:
-                        img = f_mcd.read_acquisition(acquisition)
-                        if channel_ind is not None:
-                            img = img[channel_ind, :, :]
-                        img = preprocess_image(img, hpf=hpf)
-                        yield acquisition, img, recovery_txt_file, False
-                        del img
-                    except Exception as e:
-                        logger.warning(
-                            f"Error reading acquisition {acquisition.id} "
-                            f"from file {mcd_file}: {e}"
-                        )
-                        if recovery_txt_file is not None:
-                            logger.warning(f"Recovering from file {recovery_txt_file}")
-                            zip_file_txt_member = _get_zip_file_member(
-                                recovery_txt_file
-                            )
-                            if zip_file_txt_member is None:
-                                img = _try_preprocess_txt_image_from_disk(
-                                    recovery_txt_file,
-                                    channel_names=channel_names,
-                                    hpf=hpf,
-                                )
-                                if img is not None:
-                                    yield acquisition, img, recovery_txt_file, True
-                                    del img
-                            elif unzip:
-                                zip_file, txt_member = zip_file_txt_member
-                                with ZipFile(zip_file) as fzip:
-                                    with TemporaryDirectory() as temp_dir:
-                                        extracted_recovery_txt_file = fzip.extract(
-                                            txt_member, path=temp_dir
-                                        )
-                                        img = _try_preprocess_txt_image_from_disk(
-                                            extracted_recovery_txt_file,
-                                            channel_names=channel_names,
-                                            hpf=hpf,
-                                        )
-                                        if img is not None:
-                                            yield (
-                                                acquisition,
-                                                img,
-                                                recovery_txt_file,
-                                                True,
-                                            )
-                                            del img
+            acquisition = next(
+                acquisition
+                for slide in f_mcd.slides
+                for acquisition in slide.acquisitions
+                if acquisition.id == acquisition_id
+            )
+            img = f_mcd.read_acquisition(acquisition)
+        if channel_ind is not None:
+            img = _select_channels(img, channel_ind, reuse_buffer=hpf is not None)
+        img = preprocess_image(img, hpf=hpf)
+        return img, False
     except Exception as e:
-        logger.exception(f"Error reading file {mcd_file}: {e}")
+        logger.warning(
+            f"Error reading acquisition {acquisition_id} from file {mcd_file}: {e}"
+        )
+    if recovery_txt_file is not None:
+        logger.warning(f"Recovering from file {recovery_txt_file}")
+        result = _try_unzip_and_preprocess_txt_image_from_disk(
+            recovery_txt_file, channel_names=channel_names, hpf=hpf, unzip=unzip
+        )
+        if result is not None:
+            img, _ = result
+            return img, True
+    return None
+
+
+def _list_mcd_acquisitions(mcd_file: Union[str, PathLike]) -> List[Acquisition]:
+    with MCDFile(mcd_file) as f_mcd:
+        return [
+            acquisition for slide in f_mcd.slides for acquisition in slide.acquisitions
+        ]
+
+
+def _init_preprocessing_worker() -> None:
+    # images are processed in parallel by worker processes, so each worker
+    # filters hot pixels single-threaded to avoid oversubscribing the CPU
+    global _max_filter_threads
+    _max_filter_threads = 1
+    cv2.setNumThreads(1)
+    if numba_available:
+        set_num_threads(1)
+
+
+def _get_available_cpu_count() -> int:
+    # os.cpu_count() ignores the CPU affinity of the process (e.g. taskset)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 
 def try_preprocess_images_from_disk(
@@ -409,75 +596,114 @@ def try_preprocess_images_from_disk(
     channel_names: Optional[Sequence[str]] = None,
     hpf: Optional[float] = None,
     unzip: bool = False,
+    max_workers: Optional[int] = None,
 ) -> Generator[
     Tuple[Path, Optional["Acquisition"], np.ndarray, Optional[Path], bool],
     None,
     None,
 ]:
-    candidate_txt_files = list(txt_files)
-    # process mcd files in reverse order to avoid ambiguous txt file matching
-    # see https://github.com/BodenmillerGroup/steinbock/issues/100
-    for mcd_file in sorted(
-        mcd_files, key=lambda mcd_file: Path(mcd_file).stem, reverse=True
-    ):
-        zip_file_mcd_member = _get_zip_file_member(mcd_file)
-        if zip_file_mcd_member is None:
-            for (
+    # images are preprocessed in parallel, but yielded in submission order;
+    # the number of submitted, but not yet yielded images is bounded, as
+    # finished images are kept in memory until they are yielded
+    if max_workers is None:
+        max_workers = min(_get_available_cpu_count(), _max_pending_images)
+    max_pending = max(max_workers, _max_pending_images)
+    pending = deque()
+
+    def yield_pending(max_num_pending: int):
+        while len(pending) > max_num_pending:
+            (
+                future,
+                mcd_txt_file,
                 acquisition,
-                img,
                 recovery_txt_file,
-                recovered,
-            ) in _try_preprocess_mcd_images_from_disk(
-                mcd_file,
-                candidate_txt_files,
+                temp_dir,
+            ) = pending.popleft()
+            result = future.result()
+            if temp_dir is not None and all(p[-1] is not temp_dir for p in pending):
+                temp_dir.cleanup()
+            if result is not None:
+                img, recovered = result
+                yield Path(mcd_txt_file), acquisition, img, recovery_txt_file, recovered
+                del img
+
+    candidate_txt_files = dict.fromkeys(txt_files)
+    txt_file_index = _index_txt_files(txt_files)
+    with ExitStack() as exit_stack:
+        executor = exit_stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=max_workers,
+                # forked workers hang if the parent process already started
+                # (non-fork-safe) numba/OpenMP/TBB or CUDA threads
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_preprocessing_worker,
+            )
+        )
+        # process mcd files in reverse order to avoid ambiguous txt file matching
+        # see https://github.com/BodenmillerGroup/steinbock/issues/100
+        for mcd_file in sorted(
+            mcd_files, key=lambda mcd_file: Path(mcd_file).stem, reverse=True
+        ):
+            temp_dir = None
+            extracted_mcd_file = mcd_file
+            zip_file_mcd_member = _get_zip_file_member(mcd_file)
+            if zip_file_mcd_member is not None:
+                if not unzip:
+                    continue
+                zip_file, mcd_member = zip_file_mcd_member
+                # removed once all acquisitions have been processed
+                temp_dir = TemporaryDirectory()
+                exit_stack.callback(temp_dir.cleanup)
+                with ZipFile(zip_file) as fzip:
+                    extracted_mcd_file = _extract_zip_file_member(
+                        fzip, mcd_member, temp_dir.name
+                    )
+            try:
+                acquisitions = _list_mcd_acquisitions(extracted_mcd_file)
+            except Exception as e:
+                logger.exception(f"Error reading file {mcd_file}: {e}")
+                acquisitions = []
+            for acquisition in acquisitions:
+                recovery_txt_file = _match_txt_file(
+                    mcd_file, acquisition, txt_file_index
+                )
+                if recovery_txt_file is not None:
+                    del candidate_txt_files[recovery_txt_file]
+                    del txt_file_index[acquisition.id][recovery_txt_file]
+                    recovery_txt_file = Path(recovery_txt_file)
+                channel_ind = None
+                if channel_names is not None:
+                    channel_ind = _get_channel_indices(acquisition, channel_names)
+                    if isinstance(channel_ind, str):
+                        logger.warning(
+                            f"Channel {channel_ind} not found for acquisition "
+                            f"{acquisition.id} in file {mcd_file}; skipping"
+                        )
+                        continue
+                future = executor.submit(
+                    _try_preprocess_mcd_acquisition_from_disk,
+                    extracted_mcd_file,
+                    acquisition.id,
+                    channel_ind=channel_ind,
+                    recovery_txt_file=recovery_txt_file,
+                    channel_names=channel_names,
+                    hpf=hpf,
+                    unzip=unzip,
+                )
+                pending.append(
+                    (future, mcd_file, acquisition, recovery_txt_file, temp_dir)
+                )
+                yield from yield_pending(max_pending)
+            if temp_dir is not None and all(p[-1] is not temp_dir for p in pending):
+                temp_dir.cleanup()
+        for txt_file in candidate_txt_files:
+            future = executor.submit(
+                _try_unzip_and_preprocess_txt_image_from_disk,
+                txt_file,
                 channel_names=channel_names,
                 hpf=hpf,
                 unzip=unzip,
-            ):
-                yield Path(mcd_file), acquisition, img, recovery_txt_file, recovered
-                del img
-        elif unzip:
-            zip_file, mcd_member = zip_file_mcd_member
-            with ZipFile(zip_file) as fzip:
-                with TemporaryDirectory() as temp_dir:
-                    extracted_mcd_file = fzip.extract(mcd_member, path=temp_dir)
-                    for (
-                        acquisition,
-                        img,
-                        recovery_txt_file,
-                        recovered,
-                    ) in _try_preprocess_mcd_images_from_disk(
-                        extracted_mcd_file,
-                        candidate_txt_files,
-                        channel_names=channel_names,
-                        hpf=hpf,
-                        unzip=unzip,
-                    ):
-                        yield (
-                            Path(mcd_file),
-                            acquisition,
-                            img,
-                            recovery_txt_file,
-                            recovered,
-                        )
-                        del img
-    for txt_file in candidate_txt_files:
-        zip_file_txt_member = _get_zip_file_member(txt_file)
-        if zip_file_txt_member is None:
-            img = _try_preprocess_txt_image_from_disk(
-                txt_file, channel_names=channel_names, hpf=hpf
             )
-            if img is not None:
-                yield Path(txt_file), None, img, None, False
-                del img
-        elif unzip:
-            zip_file, txt_member = zip_file_txt_member
-            with ZipFile(zip_file) as fzip:
-                with TemporaryDirectory() as temp_dir:
-                    extracted_txt_file = fzip.extract(txt_member, path=temp_dir)
-                    img = _try_preprocess_txt_image_from_disk(
-                        extracted_txt_file, channel_names=channel_names, hpf=hpf
-                    )
-                    if img is not None:
-                        yield Path(txt_file), None, img, None, False
-                        del img
+            pending.append((future, txt_file, None, None, None))
+            yield from yield_pending(max_pending)
+        yield from yield_pending(0)
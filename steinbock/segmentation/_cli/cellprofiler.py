@@ -1,14 +1,21 @@
+import os
 import sys
-from pathlib import Path
 
 import click
 import click_log
 
-from ..._cli.utils import OrderedClickGroup, catch_exception, logger
+from ..._cli.utils import (
+    OrderedClickGroup,
+    SteinbockCLIException,
+    catch_exception,
+    logger,
+)
 from ..._steinbock import SteinbockException
 from ..._steinbock import logger as steinbock_logger
 from .. import cellprofiler
 
+_known_probabilities_dirs = frozenset({"ilastik_probabilities"})
+
 
 @click.group(
     name="cellprofiler",
@@ -59,18 +66,19 @@ def prepare_cmd(segmentation_pipeline_file):
 @click.option(
     "--pipe",
     "segmentation_pipeline_file",
-    type=click.Path(exists=True, dir_okay=False),
+    type=click.Path(),
     default="cell_segmentation.cppipe",
     show_default=True,
     help="Path to the CellProfiler segmentation pipeline file",
 )
 @click.option(
     "--probabs",
-    "probabilities_dir",
-    type=click.Path(exists=True, file_okay=False),
-    default="ilastik_probabilities",
+    "probabilities_dirs",
+    type=click.Path(),
+    multiple=True,
+    default=["ilastik_probabilities"],
     show_default=True,
-    help="Path to the probabilities directory",
+    help="Path to the probabilities directory (can be specified multiple times)",
 )
 @click.option(
     "-o",
@@ -80,26 +88,129 @@ def prepare_cmd(segmentation_pipeline_file):
     show_default=True,
     help="Path to the mask output directory",
 )
+@click.option(
+    "--jobs",
+    "num_workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of CellProfiler processes run in parallel",
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=False,
+    show_default=True,
+    help="Reuse masks from previous runs on identical inputs",
+)
 @click_log.simple_verbosity_option(logger=steinbock_logger)
 @catch_exception(handle=SteinbockException)
 def run_cmd(
     cellprofiler_binary,
     cellprofiler_plugin_dir,
     segmentation_pipeline_file,
-    probabilities_dir,
+    probabilities_dirs,
     mask_dir,
+    num_workers,
+    use_cache,
 ):
-    if probabilities_dir not in ("ilastik_probabilities"):
+    # validated here rather than by click, using a single stat call per path
+    if not os.path.isfile(segmentation_pipeline_file):
+        raise SteinbockCLIException(
+            f"Segmentation pipeline file not found: {segmentation_pipeline_file}"
+        )
+    for probabilities_dir in probabilities_dirs:
+        if not os.path.isdir(probabilities_dir):
+            raise SteinbockCLIException(
+                f"Probabilities directory not found: {probabilities_dir}"
+            )
+    if not _known_probabilities_dirs.issuperset(probabilities_dirs):
         logger.warning(
             "When using custom probabilities from unknown origins, "
             "make sure to adapt the CellProfiler pipeline accordingly"
         )
-    Path(mask_dir).mkdir(exist_ok=True)
-    result = cellprofiler.try_segment_objects(
-        cellprofiler_binary,
-        segmentation_pipeline_file,
-        probabilities_dir,
-        mask_dir,
-        cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+    try:
+        os.mkdir(mask_dir)
+    except FileExistsError:
+        if not os.path.isdir(mask_dir):
+            raise
+    if num_workers > 1:
+        results = cellprofiler.try_segment_objects_parallel(
+            cellprofiler_binary,
+            segmentation_pipeline_file,
+            probabilities_dirs,
+            mask_dir,
+            cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+            num_workers=num_workers,
+            use_cache=use_cache,
+        )
+    elif len(probabilities_dirs) == 1:
+        result = cellprofiler.try_segment_objects(
+            cellprofiler_binary,
+            segmentation_pipeline_file,
+            probabilities_dirs[0],
+            mask_dir,
+            cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+            use_cache=use_cache,
+        )
+        sys.exit(result.returncode)
+    else:
+        results = cellprofiler.try_segment_objects_batch(
+            cellprofiler_binary,
+            segmentation_pipeline_file,
+            probabilities_dirs,
+            mask_dir,
+            cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+            use_cache=use_cache,
+        )
+    sys.exit(next((r.returncode for r in results if r.returncode != 0), 0))
+
+
+@cellprofiler_cmd_group.group(
+    name="daemon",
+    cls=OrderedClickGroup,
+    help="Manage a persistent CellProfiler process for segmentation batches",
+)
+def daemon_cmd_group():
+    pass
+
+
+@daemon_cmd_group.command(name="start", help="Start a CellProfiler daemon")
+@click.option(
+    "--plugins-directory",
+    "cellprofiler_plugin_dir",
+    type=click.Path(file_okay=False),
+    default="/opt/cellprofiler_plugins",
+    show_default=True,
+    help="Path to the CellProfiler plugin directory",
+)
+@click.option(
+    "--socket",
+    "cellprofiler_socket",
+    type=click.Path(dir_okay=False),
+    envvar="STEINBOCK_CP_SOCKET",
+    required=True,
+    help="Path to the daemon socket (default: $STEINBOCK_CP_SOCKET)",
+)
+@click_log.simple_verbosity_option(logger=steinbock_logger)
+@catch_exception(handle=SteinbockException)
+def daemon_start_cmd(cellprofiler_plugin_dir, cellprofiler_socket):
+    process = cellprofiler.start_daemon(
+        cellprofiler_socket, cellprofiler_plugin_dir=cellprofiler_plugin_dir
     )
-    sys.exit(result.returncode)
+    logger.info(f"CellProfiler daemon running (PID {process.pid})")
+
+
+@daemon_cmd_group.command(name="stop", help="Stop a CellProfiler daemon")
+@click.option(
+    "--socket",
+    "cellprofiler_socket",
+    type=click.Path(dir_okay=False),
+    envvar="STEINBOCK_CP_SOCKET",
+    required=True,
+    help="Path to the daemon socket (default: $STEINBOCK_CP_SOCKET)",
+)
+@click_log.simple_verbosity_option(logger=steinbock_logger)
+@catch_exception(handle=SteinbockException)
+def daemon_stop_cmd(cellprofiler_socket):
+    cellprofiler.stop_daemon(cellprofiler_socket)
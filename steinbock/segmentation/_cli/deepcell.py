@@ -5,7 +5,7 @@ import click_log
 import numpy as np
 
 from ... import io
-from ..._cli.utils import catch_exception, logger
+from ..._cli.utils import SteinbockCLIException, catch_exception, logger
 from ..._steinbock import SteinbockException
 from ..._steinbock import logger as steinbock_logger
 from .. import deepcell
@@ -38,7 +38,7 @@ _applications = {
     type=click.STRING,
     default="MultiplexSegmentation",
     show_default=True,
-    help="Path/name of custom Keras model",
+    help="Path/name of custom Keras or ONNX (.onnx) model",
 )
 @click.option(
     "--modeldir",
@@ -86,6 +86,12 @@ _applications = {
     show_default=True,
     help="Numpy function for aggregating channel pixels",
 )
+@click.option(
+    "--batchsize",
+    "batch_size",
+    type=click.IntRange(min=1),
+    help="Number of images segmented at once (default: 8 on GPU, 1 on CPU)",
+)
 @click.option(
     "--pixelsize",
     "pixel_size_um",
@@ -134,6 +140,7 @@ def deepcell_cmd(
     channelwise_zscore,
     panel_file,
     aggr_func_name,
+    batch_size,
     pixel_size_um,
     segmentation_type,
     preprocess_file,
@@ -148,7 +155,14 @@ def deepcell_cmd(
     aggr_func = getattr(np, aggr_func_name)
     img_files = io.list_image_files(img_dir)
     model = None
-    if model_path_or_name is not None:
+    if model_path_or_name is not None and model_path_or_name.endswith(".onnx"):
+        if not deepcell.onnxruntime_available:
+            raise SteinbockCLIException("ONNX models require onnxruntime")
+        model_file = Path(model_path_or_name)
+        if not model_file.exists():
+            model_file = Path(keras_model_dir) / model_path_or_name
+        model = deepcell.OnnxModel(model_file)
+    elif model_path_or_name is not None:
         from tensorflow.keras.models import load_model  # type: ignore
 
         if Path(model_path_or_name).exists():
@@ -175,6 +189,7 @@ def deepcell_cmd(
         channelwise_zscore=channelwise_zscore,
         channel_groups=channel_groups,
         aggr_func=aggr_func,
+        batch_size=batch_size,
         pixel_size_um=pixel_size_um,
         segmentation_type=segmentation_type,
         preprocess_kwargs=preprocess_kwargs,
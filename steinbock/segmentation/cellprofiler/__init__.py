@@ -1,3 +1,19 @@
-from ._cellprofiler import create_and_save_segmentation_pipeline, try_segment_objects
+from ._cellprofiler import (
+    SteinbockCellprofilerSegmentationException,
+    create_and_save_segmentation_pipeline,
+    start_daemon,
+    stop_daemon,
+    try_segment_objects,
+    try_segment_objects_batch,
+    try_segment_objects_parallel,
+)
 
-__all__ = ["create_and_save_segmentation_pipeline", "try_segment_objects"]
+__all__ = [
+    "SteinbockCellprofilerSegmentationException",
+    "create_and_save_segmentation_pipeline",
+    "start_daemon",
+    "stop_daemon",
+    "try_segment_objects",
+    "try_segment_objects_batch",
+    "try_segment_objects_parallel",
+]
@@ -1,20 +1,202 @@
+import hashlib
+import logging
+import os
 import shutil
 import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from importlib import resources
 from os import PathLike
 from pathlib import Path
-from typing import Union
+from tempfile import TemporaryDirectory
+from typing import List, Optional, Sequence, Tuple, Union
 
 from ..._env import run_captured
+from .._segmentation import SteinbockSegmentationException
+from . import _daemon
 from . import data as cellprofiler_data
 
+logger = logging.getLogger(__name__)
+
+cellprofiler_socket = os.environ.get("STEINBOCK_CP_SOCKET")
+# run headless (-c) and run the pipeline (-r)
+_base_args = ("-c", "-r")
+cellprofiler_cache_dir = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "steinbock"
+    / "cellprofiler_masks"
+)
+
+
+class SteinbockCellprofilerSegmentationException(SteinbockSegmentationException):
+    pass
+
+
+@lru_cache(maxsize=1)
+def _read_segmentation_pipeline_template() -> bytes:
+    if hasattr(resources, "files"):  # Python 3.9+
+        template = resources.files(cellprofiler_data) / "cell_segmentation.cppipe"
+        return template.read_bytes()
+    return resources.read_binary(cellprofiler_data, "cell_segmentation.cppipe")
+
 
 def create_and_save_segmentation_pipeline(
     segmentation_pipeline_file: Union[str, PathLike]
 ) -> None:
-    with resources.open_binary(cellprofiler_data, "cell_segmentation.cppipe") as fsrc:
-        with open(segmentation_pipeline_file, mode="wb") as fdst:
-            shutil.copyfileobj(fsrc, fdst)
+    with open(segmentation_pipeline_file, mode="wb") as f:
+        f.write(_read_segmentation_pipeline_template())
+
+
+def _prefetch_probability_files(probabilities_files: Sequence[Path]) -> None:
+    # asks the kernel to read the probability images into the page cache in
+    # the background, while CellProfiler starts up (a no-op where unsupported)
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for probabilities_file in probabilities_files:
+        try:
+            fd = os.open(probabilities_file, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def _get_plugin_args(
+    cellprofiler_plugin_dir: Union[str, PathLike, None]
+) -> Tuple[str, ...]:
+    if cellprofiler_plugin_dir is not None and os.path.exists(cellprofiler_plugin_dir):
+        return (f"--plugins-directory={os.fspath(cellprofiler_plugin_dir)}",)
+    return ()
+
+
+def _run_cellprofiler(args: Sequence[str]) -> subprocess.CompletedProcess:
+    if cellprofiler_socket is not None and os.path.exists(cellprofiler_socket):
+        # the CellProfiler binary is ignored when a daemon is running
+        try:
+            returncode = _daemon.submit_job(cellprofiler_socket, args)
+            return subprocess.CompletedProcess(args, returncode)
+        except (ConnectionRefusedError, FileNotFoundError):
+            logger.warning(
+                f"CellProfiler daemon not running ({cellprofiler_socket}), "
+                "running CellProfiler directly"
+            )
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise SteinbockCellprofilerSegmentationException(
+                f"CellProfiler daemon failed while running {args}: {e}"
+            ) from e
+    return run_captured(args)
+
+
+def _get_cache_key(
+    cellprofiler_binary: Union[str, PathLike],
+    segmentation_pipeline_file: Union[str, PathLike],
+    probabilities_files: Sequence[Path],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+) -> str:
+    # the CellProfiler installation is identified by its path, as querying its
+    # version would require starting CellProfiler
+    h = hashlib.blake2b()
+    for key_part in (
+        shutil.which(cellprofiler_binary) or cellprofiler_binary,
+        cellprofiler_plugin_dir or "",
+    ):
+        h.update(f"{key_part}\0".encode())
+    for file in [Path(segmentation_pipeline_file), *probabilities_files]:
+        h.update(f"{file.name}\0".encode())
+        with file.open(mode="rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _run_cellprofiler_cached(
+    args: Sequence[str],
+    cache_key: str,
+    probabilities_files: Sequence[Path],
+    mask_dir: Union[str, PathLike],
+) -> subprocess.CompletedProcess:
+    # masks are named after probability images, see the SaveImages module;
+    # cached masks are copied rather than hard-linked, as CellProfiler may
+    # overwrite masks in the mask directory in place in subsequent runs
+    mask_files = [Path(mask_dir) / f.name for f in probabilities_files]
+    cache_dir = cellprofiler_cache_dir / cache_key[:2] / cache_key
+    if cache_dir.is_dir():
+        for mask_file in mask_files:
+            shutil.copyfile(cache_dir / mask_file.name, mask_file)
+        return subprocess.CompletedProcess(args, 0)
+    result = _run_cellprofiler(args)
+    if result.returncode == 0 and all(f.is_file() for f in mask_files):
+        # caching is best-effort and must not fail a successful run
+        temp_cache_dir = cache_dir.with_name(f".{cache_key}.{os.getpid()}")
+        try:
+            temp_cache_dir.mkdir(parents=True, exist_ok=True)
+            for mask_file in mask_files:
+                shutil.copyfile(mask_file, temp_cache_dir / mask_file.name)
+            try:
+                temp_cache_dir.rename(cache_dir)
+            except OSError:  # cached concurrently
+                shutil.rmtree(temp_cache_dir)
+        except OSError as e:
+            logger.warning(f"Error caching masks in {cellprofiler_cache_dir}: {e}")
+            shutil.rmtree(temp_cache_dir, ignore_errors=True)
+    return result
+
+
+def start_daemon(
+    cellprofiler_socket: Union[str, PathLike],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+    timeout: float = 300.0,
+) -> subprocess.Popen:
+    if os.path.exists(cellprofiler_socket):
+        if _daemon.is_running(cellprofiler_socket):
+            raise SteinbockCellprofilerSegmentationException(
+                f"CellProfiler daemon already running: {cellprofiler_socket}"
+            )
+        logger.info(f"Removing stale CellProfiler daemon socket {cellprofiler_socket}")
+        Path(cellprofiler_socket).unlink(missing_ok=True)
+    args = [
+        sys.executable,
+        "-c",
+        f"from {_daemon.__name__} import main; main()",
+        os.fspath(cellprofiler_socket),
+    ]
+    if cellprofiler_plugin_dir is not None:
+        args.append(os.fspath(cellprofiler_plugin_dir))
+    process = subprocess.Popen(args, start_new_session=True)
+    start_time = time.monotonic()
+    while not os.path.exists(cellprofiler_socket):
+        if process.poll() is not None:
+            raise SteinbockCellprofilerSegmentationException(
+                f"CellProfiler daemon exited with code {process.returncode}"
+            )
+        if time.monotonic() - start_time > timeout:
+            process.kill()
+            raise SteinbockCellprofilerSegmentationException(
+                "Timeout while starting the CellProfiler daemon"
+            )
+        time.sleep(0.1)
+    return process
+
+
+def stop_daemon(cellprofiler_socket: Union[str, PathLike]) -> None:
+    if not os.path.exists(cellprofiler_socket):
+        raise SteinbockCellprofilerSegmentationException(
+            f"CellProfiler daemon socket not found: {cellprofiler_socket}"
+        )
+    try:
+        _daemon.stop(cellprofiler_socket)
+    except ConnectionRefusedError:
+        Path(cellprofiler_socket).unlink(missing_ok=True)
+        raise SteinbockCellprofilerSegmentationException(
+            f"CellProfiler daemon not running, removed stale socket "
+            f"{cellprofiler_socket}"
+        )
 
 
 def try_segment_objects(
@@ -23,18 +205,147 @@ def try_segment_objects(
     probabilities_dir: Union[str, PathLike],
     mask_dir: Union[str, PathLike],
     cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+    use_cache: bool = False,
 ) -> subprocess.CompletedProcess:
-    args = [
-        str(cellprofiler_binary),
-        "-c",
-        "-r",
+    args = (
+        os.fspath(cellprofiler_binary),
+        *_base_args,
         "-p",
-        str(segmentation_pipeline_file),
+        os.fspath(segmentation_pipeline_file),
         "-i",
-        str(probabilities_dir),
+        os.fspath(probabilities_dir),
         "-o",
-        str(mask_dir),
+        os.fspath(mask_dir),
+        *_get_plugin_args(cellprofiler_plugin_dir),
+    )
+    if use_cache:
+        probabilities_files = sorted(Path(probabilities_dir).rglob("[!.]*.tiff"))
+        cache_key = _get_cache_key(
+            cellprofiler_binary,
+            segmentation_pipeline_file,
+            probabilities_files,
+            cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+        )
+        return _run_cellprofiler_cached(args, cache_key, probabilities_files, mask_dir)
+    _prefetch_probability_files(sorted(Path(probabilities_dir).rglob("[!.]*.tiff")))
+    return _run_cellprofiler(args)
+
+
+def _list_probabilities_files(
+    probabilities_dirs: Sequence[Union[str, PathLike]]
+) -> List[List[Path]]:
+    # masks are named after probability images and written to the same mask
+    # directory, so file names have to be unique across directories
+    probabilities_file_names = set()
+    probabilities_files = []
+    for probabilities_dir in probabilities_dirs:
+        probabilities_files.append(sorted(Path(probabilities_dir).rglob("[!.]*.tiff")))
+        for probabilities_file in probabilities_files[-1]:
+            if probabilities_file.name in probabilities_file_names:
+                raise SteinbockCellprofilerSegmentationException(
+                    f"Duplicate probabilities file name: {probabilities_file.name}"
+                )
+            probabilities_file_names.add(probabilities_file.name)
+    return probabilities_files
+
+
+def _try_segment_probabilities_files(
+    cellprofiler_binary: Union[str, PathLike],
+    segmentation_pipeline_file: Union[str, PathLike],
+    probabilities_files: Sequence[Path],
+    mask_dir: Union[str, PathLike],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+    use_cache: bool = False,
+) -> subprocess.CompletedProcess:
+    probabilities_files = [f.resolve() for f in probabilities_files]
+    with TemporaryDirectory() as temp_dir:
+        file_list_file = Path(temp_dir) / "file_list.txt"
+        file_list_file.write_text("".join(f"{f}\n" for f in probabilities_files))
+        args = (
+            os.fspath(cellprofiler_binary),
+            *_base_args,
+            "-p",
+            os.fspath(segmentation_pipeline_file),
+            f"--file-list={file_list_file}",
+            "-o",
+            os.fspath(mask_dir),
+            *_get_plugin_args(cellprofiler_plugin_dir),
+        )
+        if use_cache:
+            cache_key = _get_cache_key(
+                cellprofiler_binary,
+                segmentation_pipeline_file,
+                probabilities_files,
+                cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+            )
+            return _run_cellprofiler_cached(
+                args, cache_key, probabilities_files, mask_dir
+            )
+        _prefetch_probability_files(probabilities_files)
+        return _run_cellprofiler(args)
+
+
+def try_segment_objects_batch(
+    cellprofiler_binary: Union[str, PathLike],
+    segmentation_pipeline_file: Union[str, PathLike],
+    probabilities_dirs: Sequence[Union[str, PathLike]],
+    mask_dir: Union[str, PathLike],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+    max_batch_size: int = 64,
+    use_cache: bool = False,
+) -> List[subprocess.CompletedProcess]:
+    probabilities_files = _list_probabilities_files(probabilities_dirs)
+    results = []
+    # segments up to max_batch_size probabilities directories per invocation
+    for i in range(0, len(probabilities_dirs), max_batch_size):
+        result = _try_segment_probabilities_files(
+            cellprofiler_binary,
+            segmentation_pipeline_file,
+            [
+                probabilities_file
+                for dir_probabilities_files in probabilities_files[
+                    i : i + max_batch_size
+                ]
+                for probabilities_file in dir_probabilities_files
+            ],
+            mask_dir,
+            cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+            use_cache=use_cache,
+        )
+        results.append(result)
+    return results
+
+
+def try_segment_objects_parallel(
+    cellprofiler_binary: Union[str, PathLike],
+    segmentation_pipeline_file: Union[str, PathLike],
+    probabilities_dirs: Sequence[Union[str, PathLike]],
+    mask_dir: Union[str, PathLike],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+    num_workers: Optional[int] = None,
+    use_cache: bool = False,
+) -> List[subprocess.CompletedProcess]:
+    probabilities_files = [
+        probabilities_file
+        for dir_probabilities_files in _list_probabilities_files(probabilities_dirs)
+        for probabilities_file in dir_probabilities_files
     ]
-    if cellprofiler_plugin_dir is not None and Path(cellprofiler_plugin_dir).exists():
-        args.append(f"--plugins-directory={cellprofiler_plugin_dir}")
-    return run_captured(args)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(probabilities_files)))
+    # probability images are distributed across CellProfiler runs in a
+    # round-robin fashion; threads suffice, as all work is done by CellProfiler
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                _try_segment_probabilities_files,
+                cellprofiler_binary,
+                segmentation_pipeline_file,
+                probabilities_files[i::num_workers],
+                mask_dir,
+                cellprofiler_plugin_dir=cellprofiler_plugin_dir,
+                use_cache=use_cache,
+            )
+            for i in range(num_workers)
+        ]
+        return [future.result() for future in futures]
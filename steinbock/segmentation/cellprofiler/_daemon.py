@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import socket
+import sys
+from os import PathLike
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+
+def _send_request(
+    cellprofiler_socket: Union[str, PathLike], request: Dict[str, Any]
+) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(os.fspath(cellprofiler_socket))
+        with client.makefile(mode="rwb") as f:
+            f.write(json.dumps(request).encode() + b"\n")
+            f.flush()
+            line = f.readline()
+    if not line:  # e.g. the daemon died while running the job
+        raise ConnectionResetError(
+            f"CellProfiler daemon closed the connection: {cellprofiler_socket}"
+        )
+    return json.loads(line)
+
+
+def submit_job(cellprofiler_socket: Union[str, PathLike], args: Sequence[str]) -> int:
+    response = _send_request(cellprofiler_socket, {"args": list(args)})
+    return response["returncode"]
+
+
+def stop(cellprofiler_socket: Union[str, PathLike]) -> None:
+    _send_request(cellprofiler_socket, {"command": "stop"})
+
+
+def is_running(cellprofiler_socket: Union[str, PathLike]) -> bool:
+    # a socket file left behind by a killed daemon refuses connections
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(os.fspath(cellprofiler_socket))
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
+def _run_job(args: Sequence[str]) -> int:
+    from cellprofiler.__main__ import parse_args, run_pipeline_headless
+    from cellprofiler_core.preferences import (
+        get_default_image_directory,
+        get_default_output_directory,
+        get_image_set_file,
+        set_default_image_directory,
+        set_default_output_directory,
+        set_image_set_file,
+    )
+
+    options, args = parse_args(args)
+    # CellProfiler's main() applies these options as (process-wide) preferences,
+    # not run_pipeline_headless; apply them per job and restore them afterwards
+    image_dir = get_default_image_directory()
+    output_dir = get_default_output_directory()
+    image_set_file = get_image_set_file()
+    try:
+        if options.image_set_file is not None:
+            set_image_set_file(options.image_set_file)
+        if options.output_directory:
+            os.makedirs(options.output_directory, exist_ok=True)
+            set_default_output_directory(options.output_directory)
+        if options.image_directory:
+            set_default_image_directory(options.image_directory)
+        returncode = run_pipeline_headless(options, args)
+    finally:
+        set_image_set_file(image_set_file)
+        set_default_output_directory(output_dir)
+        set_default_image_directory(image_dir)
+    return returncode or 0
+
+
+def serve(
+    cellprofiler_socket: Union[str, PathLike],
+    cellprofiler_plugin_dir: Union[str, PathLike, None] = None,
+) -> None:
+    # CellProfiler (including the Java VM) is initialized once; each job then
+    # runs through CellProfiler's own headless code path, as with `cellprofiler -c`
+    from cellprofiler_core.preferences import set_headless, set_plugin_directory
+    from cellprofiler_core.utilities.java import start_java, stop_java
+
+    set_headless()
+    if cellprofiler_plugin_dir is not None and os.path.exists(cellprofiler_plugin_dir):
+        set_plugin_directory(os.fspath(cellprofiler_plugin_dir), globally=False)
+    start_java()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(os.fspath(cellprofiler_socket))
+            server.listen()
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile(mode="rwb") as f:
+                    line = f.readline()
+                    if not line:  # e.g. is_running() probing the socket
+                        continue
+                    request = json.loads(line)
+                    if request.get("command") == "stop":
+                        f.write(json.dumps({}).encode() + b"\n")
+                        break
+                    try:
+                        returncode = _run_job(request["args"])
+                    except:
+                        logger.exception(f"Error running {request['args']}")
+                        returncode = 1
+                    f.write(json.dumps({"returncode": returncode}).encode() + b"\n")
+    finally:
+        Path(cellprofiler_socket).unlink(missing_ok=True)
+        stop_java()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    if argv is None:
+        argv = sys.argv[1:]
+    logging.basicConfig(level=logging.INFO)
+    serve(*argv)
@@ -1,7 +1,9 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import partial
 from importlib.util import find_spec
+from itertools import groupby
 from os import PathLike
 from pathlib import Path
 from typing import (
@@ -9,6 +11,7 @@ from typing import (
     Any,
     Callable,
     Generator,
+    List,
     Mapping,
     Optional,
     Sequence,
@@ -16,6 +19,7 @@ from typing import (
     Union,
 )
 
+import cv2
 import numpy as np
 
 from .. import io
@@ -27,41 +31,84 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 deepcell_available = find_spec("deepcell") is not None
+onnxruntime_available = find_spec("onnxruntime") is not None
 
 
 class SteinbockDeepcellSegmentationException(SteinbockSegmentationException):
     pass
 
 
+class OnnxModel:
+    """Keras-like wrapper around an ONNX Runtime inference session
+
+    Exposes the subset of the Keras model interface used by DeepCell
+    applications, such that exported models can be passed as `model`.
+    """
+
+    def __init__(
+        self,
+        model_file: Union[str, PathLike],
+        providers: Optional[Sequence[str]] = None,
+    ) -> None:
+        import onnxruntime as ort  # type: ignore
+
+        if providers is None:
+            providers = [
+                provider
+                for provider in ("CUDAExecutionProvider", "CPUExecutionProvider")
+                if provider in ort.get_available_providers()
+            ]
+        self._session = ort.InferenceSession(str(model_file), providers=providers)
+        model_input = self._session.get_inputs()[0]
+        self.input_name: str = model_input.name
+        self.input_shape = tuple(
+            dim if isinstance(dim, int) else None for dim in model_input.shape
+        )
+        self.output_names = [output.name for output in self._session.get_outputs()]
+
+    @property
+    def providers(self) -> List[str]:
+        return self._session.get_providers()
+
+    def predict(
+        self, x: np.ndarray, batch_size: Optional[int] = None
+    ) -> List[np.ndarray]:
+        # DeepCell applications batch inputs themselves, so batch_size is unused
+        return self._session.run(
+            self.output_names,
+            {self.input_name: np.ascontiguousarray(x, dtype=np.float32)},
+        )
+
+
 def _mesmer_application(model=None):
     from deepcell.applications import Mesmer
 
     app = Mesmer(model=model)
 
     def predict(
-        img: np.ndarray,
+        imgs: np.ndarray,
         *,
         pixel_size_um: Optional[float] = None,
         segmentation_type: Optional[str] = None,
         preprocess_kwargs: Optional[Mapping[str, Any]] = None,
         postprocess_kwargs: Optional[Mapping[str, Any]] = None,
     ) -> np.ndarray:
-        assert img.ndim == 3
+        assert imgs.ndim == 4
         if pixel_size_um is None:
             raise SteinbockDeepcellSegmentationException("Unknown pixel size")
         if segmentation_type is None:
             raise SteinbockDeepcellSegmentationException("Unknown segmentation type")
-        mask = app.predict(
-            np.expand_dims(np.moveaxis(img, 0, -1), 0),
-            batch_size=1,
+        masks = app.predict(
+            np.moveaxis(imgs, 1, -1),
+            batch_size=imgs.shape[0],
             image_mpp=pixel_size_um,
             compartment=segmentation_type,
             preprocess_kwargs=preprocess_kwargs or {},
             postprocess_kwargs_whole_cell=postprocess_kwargs or {},
             postprocess_kwargs_nuclear=postprocess_kwargs or {},
-        )[0, :, :, 0]
-        assert mask.shape == img.shape[1:]
-        return mask
+        )[:, :, :, 0]
+        assert masks.shape == imgs.shape[:1] + imgs.shape[2:]
+        return masks
 
     return app, predict
 
@@ -72,6 +119,68 @@ class Application(Enum):
     MESMER = partial(_mesmer_application)
 
 
+def _aggregate_channel_groups(
+    img: np.ndarray,
+    channel_groups: np.ndarray,
+    aggr_func: Callable[[np.ndarray], np.ndarray] = np.mean,
+) -> np.ndarray:
+    unique_channel_groups = [
+        channel_group
+        for channel_group in np.unique(channel_groups)
+        if not np.isnan(channel_group)
+    ]
+    if aggr_func is not np.mean:
+        return np.stack(
+            [
+                aggr_func(img[channel_groups == channel_group], axis=0)
+                for channel_group in unique_channel_groups
+            ]
+        )
+    # compute all channel group means using a single matrix multiplication
+    group_matrix = np.stack(
+        [channel_groups == channel_group for channel_group in unique_channel_groups]
+    ).astype(np.result_type(img.dtype, np.float32))
+    group_matrix /= np.sum(group_matrix, axis=1, keepdims=True)
+    group_img = np.tensordot(group_matrix, img, axes=([1], [0]))
+    # NaNs propagate across channel groups in matrix multiplications
+    for i, channel_group in enumerate(unique_channel_groups):
+        if np.isnan(group_img[i]).any():
+            group_img[i] = np.mean(img[channel_groups == channel_group], axis=0)
+    return group_img
+
+
+def _normalize_integer_channels(
+    img: np.ndarray,
+    channelwise_minmax: bool = False,
+    channelwise_zscore: bool = False,
+) -> np.ndarray:
+    # for uint8/uint16 images, channel statistics are derived from histograms
+    # and pixels are normalized by table lookup instead of arithmetic
+    values = np.arange(np.iinfo(img.dtype).max + 1, dtype=np.float64)
+    normalized_img = np.empty(img.shape, dtype=np.float32)
+    for channel_index in range(img.shape[0]):
+        counts = np.bincount(img[channel_index].ravel(), minlength=len(values))
+        lut = values.copy()
+        if channelwise_minmax:
+            nonzero_values = values[counts > 0]
+            channel_min, channel_max = nonzero_values[0], nonzero_values[-1]
+            lut -= channel_min
+            if channel_max > channel_min:
+                lut /= channel_max - channel_min
+        if channelwise_zscore:
+            channel_mean = np.average(lut, weights=counts)
+            channel_std = np.sqrt(np.average((lut - channel_mean) ** 2, weights=counts))
+            lut -= channel_mean
+            if channel_std > 0:
+                lut /= channel_std
+        lut = lut.astype(np.float32)
+        if img.dtype == np.uint8:
+            cv2.LUT(img[channel_index], lut, dst=normalized_img[channel_index])
+        else:
+            np.take(lut, img[channel_index], out=normalized_img[channel_index])
+    return normalized_img
+
+
 def create_segmentation_stack(
     img: np.ndarray,
     channelwise_minmax: bool = False,
@@ -79,52 +188,111 @@ def create_segmentation_stack(
     channel_groups: Optional[np.ndarray] = None,
     aggr_func: Callable[[np.ndarray], np.ndarray] = np.mean,
 ) -> np.ndarray:
-    if channelwise_minmax:
-        channel_mins = np.nanmin(img, axis=(1, 2))
-        channel_maxs = np.nanmax(img, axis=(1, 2))
-        channel_ranges = channel_maxs - channel_mins
-        img -= channel_mins[:, np.newaxis, np.newaxis]
-        img[channel_ranges > 0] /= channel_ranges[
-            channel_ranges > 0, np.newaxis, np.newaxis
-        ]
-    if channelwise_zscore:
-        channel_means = np.nanmean(img, axis=(1, 2))
-        channel_stds = np.nanstd(img, axis=(1, 2))
-        img -= channel_means[:, np.newaxis, np.newaxis]
-        img[channel_stds > 0] /= channel_stds[channel_stds > 0, np.newaxis, np.newaxis]
-    if channel_groups is not None:
-        img = np.stack(
-            [
-                aggr_func(img[channel_groups == channel_group], axis=0)
-                for channel_group in np.unique(channel_groups)
-                if not np.isnan(channel_group)
-            ]
+    if img.dtype in (np.uint8, np.uint16) and (
+        channelwise_minmax or channelwise_zscore
+    ):
+        img = _normalize_integer_channels(
+            img,
+            channelwise_minmax=channelwise_minmax,
+            channelwise_zscore=channelwise_zscore,
         )
+    else:
+        if channelwise_minmax:
+            channel_mins = np.nanmin(img, axis=(1, 2), keepdims=True)
+            channel_maxs = np.nanmax(img, axis=(1, 2), keepdims=True)
+            channel_ranges = channel_maxs - channel_mins
+            img -= channel_mins
+            img /= np.where(channel_ranges > 0, channel_ranges, 1)
+        if channelwise_zscore:
+            channel_means = np.nanmean(img, axis=(1, 2), keepdims=True)
+            channel_stds = np.nanstd(img, axis=(1, 2), keepdims=True)
+            img -= channel_means
+            img /= np.where(channel_stds > 0, channel_stds, 1)
+    if channel_groups is not None:
+        img = _aggregate_channel_groups(img, channel_groups, aggr_func=aggr_func)
     return img
 
 
+def _get_default_batch_size(model: Union["Model", OnnxModel, None] = None) -> int:
+    if isinstance(model, OnnxModel):
+        if "CUDAExecutionProvider" in model.providers:
+            return 8
+        return 1
+    import tensorflow as tf  # type: ignore
+
+    if len(tf.config.list_physical_devices("GPU")) > 0:
+        return 8
+    return 1
+
+
+def _try_create_segmentation_stacks(
+    img_files: Sequence[Union[str, PathLike]], **kwargs
+) -> List[Tuple[Path, np.ndarray]]:
+    segstacks = []
+    for img_file in img_files:
+        try:
+            img = create_segmentation_stack(io.read_image(img_file), **kwargs)
+            segstacks.append((Path(img_file), img))
+        except:
+            logger.exception(f"Error segmenting objects in {img_file}")
+    return segstacks
+
+
 def try_segment_objects(
     img_files: Sequence[Union[str, PathLike]],
     application: Application,
-    model: Optional["Model"] = None,
+    model: Union["Model", OnnxModel, None] = None,
     channelwise_minmax: bool = False,
     channelwise_zscore: bool = False,
     channel_groups: Optional[np.ndarray] = None,
     aggr_func: Callable[[np.ndarray], np.ndarray] = np.mean,
+    batch_size: Optional[int] = None,
     **predict_kwargs,
 ) -> Generator[Tuple[Path, np.ndarray], None, None]:
     app, predict = application.value(model=model)
-    for img_file in img_files:
-        try:
-            img = create_segmentation_stack(
-                io.read_image(img_file),
-                channelwise_minmax=channelwise_minmax,
-                channelwise_zscore=channelwise_zscore,
-                channel_groups=channel_groups,
-                aggr_func=aggr_func,
-            )
-            mask = predict(img, **predict_kwargs)
-            yield Path(img_file), mask
-            del img, mask
-        except:
-            logger.exception(f"Error segmenting objects in {img_file}")
+    if batch_size is None:
+        batch_size = _get_default_batch_size(model=model)
+    img_files = list(img_files)
+    img_file_batches = [
+        img_files[i : i + batch_size] for i in range(0, len(img_files), batch_size)
+    ]
+    create_segmentation_stacks = partial(
+        _try_create_segmentation_stacks,
+        channelwise_minmax=channelwise_minmax,
+        channelwise_zscore=channelwise_zscore,
+        channel_groups=channel_groups,
+        aggr_func=aggr_func,
+    )
+    # read the next batch of images while the current batch is being segmented
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = None
+        if len(img_file_batches) > 0:
+            future = executor.submit(create_segmentation_stacks, img_file_batches[0])
+        for i in range(len(img_file_batches)):
+            segstacks = future.result()
+            if i + 1 < len(img_file_batches):
+                future = executor.submit(
+                    create_segmentation_stacks, img_file_batches[i + 1]
+                )
+            # only images of the same shape are segmented together
+            for _, group in groupby(segstacks, key=lambda x: x[1].shape):
+                group_img_files, group_imgs = zip(*group)
+                try:
+                    masks = predict(np.stack(group_imgs), **predict_kwargs)
+                except:
+                    if len(group_img_files) == 1:
+                        logger.exception(
+                            f"Error segmenting objects in {group_img_files[0]}"
+                        )
+                        continue
+                    masks = []
+                    for img_file, img in zip(group_img_files, group_imgs):
+                        try:
+                            masks.append(predict(img[np.newaxis], **predict_kwargs)[0])
+                        except:
+                            logger.exception(f"Error segmenting objects in {img_file}")
+                            masks.append(None)
+                for img_file, mask in zip(group_img_files, masks):
+                    if mask is not None:
+                        yield img_file, mask
+                del group_imgs, masks
@@ -1,11 +1,28 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
+from zipfile import ZipFile
 
 import numpy as np
 import pytest
+from scipy.ndimage import maximum_filter
 from steinbock import io
 from steinbock.preprocessing import imc
 
 
+def _write_txt_file(txt_file: Path, img: np.ndarray, channels) -> None:
+    # minimal IMC .txt file: push and XYZ columns, followed by one column per
+    # channel, with one row per pixel
+    lines = ["\t".join(["Start_push", "End_push", "Pushes_duration", "X", "Y", "Z"])]
+    lines[0] += "".join(f"\t{channel}" for channel in channels)
+    for y in range(img.shape[1]):
+        for x in range(img.shape[2]):
+            values = [0, 0, 0, x, y, 0] + img[:, y, x].tolist()
+            lines.append("\t".join(str(value) for value in values))
+    txt_file.write_text("\n".join(lines) + "\n")
+
+
 @pytest.mark.skipif(not imc.imc_available, reason="IMC is not available")
 class TestIMCPreprocessing:
     def test_list_mcd_files(self, imc_test_data_steinbock_path: Path):
@@ -38,6 +55,42 @@ class TestIMCPreprocessing:
         )
         assert np.all(filtered_img == expected_filtered_img)
 
+    @pytest.mark.parametrize(
+        "dtype", [np.float32, np.float64, np.uint8, np.uint16, np.int16, np.int32]
+    )
+    @pytest.mark.parametrize(
+        "shape", [(2, 7, 9), (1, 1, 5), (1, 5, 1), (2, 1, 1), (1, 2, 2)]
+    )
+    @pytest.mark.parametrize("out_mode", ["none", "out", "inplace"])
+    @pytest.mark.parametrize("use_numba", [True, False])
+    def test_filter_hot_pixels_reference(
+        self, dtype, shape, out_mode, use_numba, monkeypatch
+    ):
+        if use_numba and not imc.numba_available:
+            pytest.skip("numba is not available")
+        monkeypatch.setattr(imc, "numba_available", use_numba)
+        rng = np.random.default_rng(seed=0)
+        img = rng.integers(0, 100, size=shape).astype(dtype)
+        img.flat[:: max(1, img.size // 5)] = 120  # hot pixels
+        kernel = np.ones((1, 3, 3), dtype=bool)
+        kernel[0, 1, 1] = False
+        max_neighbor_img = maximum_filter(img, footprint=kernel, mode="mirror")
+        expected_filtered_img = np.where(
+            img - max_neighbor_img > 3, max_neighbor_img, img
+        )
+        if out_mode == "none":
+            filtered_img = imc.filter_hot_pixels(img, 3.0)
+        elif out_mode == "out":
+            out = np.empty_like(img)
+            filtered_img = imc.filter_hot_pixels(img, 3.0, out=out)
+            assert filtered_img is out
+        else:
+            img_copy = img.copy()
+            filtered_img = imc.filter_hot_pixels(img_copy, 3.0, out=img_copy)
+            assert filtered_img is img_copy
+        assert filtered_img.dtype == img.dtype
+        assert np.array_equal(filtered_img, expected_filtered_img)
+
     def test_preprocess_image(self):
         img = np.array(
             [
@@ -62,6 +115,115 @@ class TestIMCPreprocessing:
         )
         assert np.all(preprocessed_img == expected_preprocessed_img)
 
+    def test_preprocess_image_threads(self):
+        # the float32 buffer used for hot pixel filtering must not be shared
+        # between threads
+        rng = np.random.default_rng(seed=0)
+        imgs = [rng.integers(0, 100, size=(3, 200, 200), dtype=np.uint16)]
+        imgs += [img.copy() for img in imgs * 7]
+        for i, img in enumerate(imgs):
+            img[:, :, :] += i
+        expected_imgs = [
+            io._to_dtype(
+                imc.filter_hot_pixels(img.astype(np.float32), 50), io.img_dtype
+            )
+            for img in imgs
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            preprocessed_imgs = list(
+                executor.map(lambda img: imc.preprocess_image(img, hpf=50), imgs * 4)
+            )
+        for preprocessed_img, expected_img in zip(preprocessed_imgs, expected_imgs * 4):
+            assert np.array_equal(preprocessed_img, expected_img)
+
+    def test_get_float32_buffer(self):
+        barrier = threading.Barrier(2)  # ensures that two threads are used
+
+        def run_in_thread():
+            barrier.wait()
+            large_buf = imc._get_float32_buffer((2, 5, 5))
+            small_buf = imc._get_float32_buffer((3, 2, 4))
+            assert large_buf.shape == (2, 5, 5) and small_buf.shape == (3, 2, 4)
+            assert small_buf.base is large_buf.base  # a single buffer is reused
+            assert imc._get_float32_buffer((3, 5, 5)).base is not large_buf.base
+            return imc._get_float32_buffer((1, 1, 1)).base
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            bufs = [executor.submit(run_in_thread) for _ in range(2)]
+            assert bufs[0].result() is not bufs[1].result()
+
+    @pytest.mark.parametrize("dtype", [np.float32, np.uint16])
+    def test_select_channels(self, dtype):
+        rng = np.random.default_rng(seed=0)
+        imgs = [
+            rng.integers(0, 100, size=shape).astype(dtype)
+            for shape in [(4, 6, 5), (5, 3, 7), (4, 6, 5)]
+        ]
+        channel_ind = [3, 0, 2]
+        preprocessed_imgs = [
+            imc.preprocess_image(
+                imc._select_channels(img, channel_ind, reuse_buffer=True), hpf=50
+            )
+            for img in imgs
+        ]
+        for img, preprocessed_img in zip(imgs, preprocessed_imgs):
+            expected_img = imc.filter_hot_pixels(
+                img[channel_ind].astype(np.float32), 50
+            )
+            assert np.array_equal(
+                preprocessed_img, io._to_dtype(expected_img, io.img_dtype)
+            )
+
+    def test_index_txt_files(self):
+        txt_files = [
+            "raw/slide_001.txt",
+            "raw/slide_ROI_xy_2.txt",
+            "raw/a.b_1.txt",
+            "raw/slide_3.txtx",
+            "raw/slide.txt",
+            "raw/slide_x.txt",
+        ]
+        assert imc._index_txt_files(txt_files) == {
+            1: {"raw/slide_001.txt": "slide", "raw/a.b_1.txt": "a.b"},
+            2: {"raw/slide_ROI_xy_2.txt": "slide_ROI_xy"},
+        }
+
+    def test_match_txt_file(self, caplog):
+        txt_file_index = imc._index_txt_files(
+            [
+                "raw/slide_001.txt",  # zero-padded acquisition ID
+                "raw/slide_ROI_xy_2.txt",  # text between stem and acquisition ID
+                "raw/slide_a_3.txt",
+                "raw/slide_b_3.txt",
+                "raw/a.b_1.txt",
+                "raw/axb_2.txt",
+                "raw/slide2_4.txt",
+                "raw/slide_4.txt",
+            ]
+        )
+
+        def match_txt_file(mcd_file, acquisition_id):
+            acquisition = SimpleNamespace(id=acquisition_id)
+            return imc._match_txt_file(mcd_file, acquisition, txt_file_index)
+
+        assert match_txt_file("raw/slide.mcd", 1) == "raw/slide_001.txt"
+        assert match_txt_file("raw/slide.mcd", 2) == "raw/slide_ROI_xy_2.txt"
+        assert match_txt_file("raw/slide.mcd", 5) is None
+        assert match_txt_file("raw/other.mcd", 1) is None
+        # stems are matched literally, not as regular expressions
+        assert match_txt_file("raw/a.b.mcd", 1) == "raw/a.b_1.txt"
+        assert match_txt_file("raw/a.b.mcd", 2) is None
+        # ambiguous matches are not resolved
+        caplog.clear()
+        assert match_txt_file("raw/slide.mcd", 3) is None
+        assert "Ambiguous txt file matching" in caplog.text
+        # slide2_4.txt also matches slide.mcd, so slide2.mcd has to be matched
+        # (and its match removed from the index) first, see issue #100
+        assert match_txt_file("raw/slide.mcd", 4) is None
+        assert match_txt_file("raw/slide2.mcd", 4) == "raw/slide2_4.txt"
+        del txt_file_index[4]["raw/slide2_4.txt"]
+        assert match_txt_file("raw/slide.mcd", 4) == "raw/slide_4.txt"
+
     def test_try_preprocess_images_from_disk(self, imc_test_data_steinbock_path: Path):
         mcd_files = imc.list_mcd_files(imc_test_data_steinbock_path / "raw")
         txt_files = imc.list_txt_files(imc_test_data_steinbock_path / "raw")
@@ -69,6 +231,89 @@ class TestIMCPreprocessing:
         for mcd_txt_file, acquisition, img, recovery_file, recovered in gen:
             pass  # TODO
 
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_try_preprocess_txt_images_from_disk(self, max_workers, tmp_path: Path):
+        channels = ["DNA(Ir191Di)", "H3(In113Di)"]
+        imgs = {}
+        txt_files = []
+        for i in range(5):
+            img = np.arange(2 * 3 * 4, dtype=np.float32).reshape((2, 3, 4)) + i
+            img[1, 1, 2] = 1000  # hot pixel
+            txt_file = tmp_path / f"image{i}_{i + 1}.txt"
+            _write_txt_file(txt_file, img, channels)
+            imgs[txt_file] = img
+            txt_files.append(txt_file)
+        zipped_img = np.ones((2, 3, 4), dtype=np.float32)
+        _write_txt_file(tmp_path / "zipped_1.txt", zipped_img, channels)
+        with ZipFile(tmp_path / "zipped.zip", mode="w") as fzip:
+            fzip.write(tmp_path / "zipped_1.txt", arcname="zipped_1.txt")
+        (tmp_path / "zipped_1.txt").unlink()
+        imgs[tmp_path / "zipped.zip" / "zipped_1.txt"] = zipped_img
+        txt_files.append(tmp_path / "zipped.zip" / "zipped_1.txt")
+        gen = imc.try_preprocess_images_from_disk(
+            [],
+            txt_files,
+            channel_names=["In113", "Ir191"],
+            hpf=50,
+            unzip=True,
+            max_workers=max_workers,
+        )
+        results = list(gen)
+        assert [result[0] for result in results] == txt_files  # submission order
+        for txt_file, acquisition, img, recovery_txt_file, recovered in results:
+            assert acquisition is None and recovery_txt_file is None
+            assert not recovered
+            expected_img = imgs[txt_file][::-1]
+            expected_img = imc.filter_hot_pixels(expected_img, 50)
+            assert np.array_equal(img, io._to_dtype(expected_img, io.img_dtype))
+
+    @pytest.mark.parametrize("close_early", [False, True])
+    def test_try_preprocess_zipped_mcd_images_from_disk(
+        self, close_early, monkeypatch, tmp_path: Path
+    ):
+        # reading .mcd files is left to readimc; this test covers the handling
+        # of extracted .mcd files by the image generator in-process
+        extracted_mcd_files = []
+
+        def try_preprocess_mcd_acquisition_from_disk(mcd_file, acquisition_id, **kw):
+            assert Path(mcd_file).read_bytes() == b"mcd"
+            extracted_mcd_files.append(Path(mcd_file))
+            return np.full((1, 2, 2), acquisition_id, dtype=io.img_dtype), False
+
+        monkeypatch.setattr(
+            imc,
+            "ProcessPoolExecutor",
+            lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers),
+        )
+        monkeypatch.setattr(
+            imc,
+            "_list_mcd_acquisitions",
+            lambda mcd_file: [SimpleNamespace(id=i) for i in range(1, 11)],
+        )
+        monkeypatch.setattr(
+            imc,
+            "_try_preprocess_mcd_acquisition_from_disk",
+            try_preprocess_mcd_acquisition_from_disk,
+        )
+        with ZipFile(tmp_path / "raw.zip", mode="w") as fzip:
+            fzip.writestr("slide.mcd", b"mcd")
+        mcd_files = imc.list_mcd_files(tmp_path, unzip=True)
+        assert mcd_files == [tmp_path / "raw.zip" / "slide.mcd"]
+        gen = imc.try_preprocess_images_from_disk(
+            mcd_files, [], unzip=True, max_workers=2
+        )
+        if close_early:
+            mcd_file, acquisition, img, _, _ = next(gen)
+            assert acquisition.id == 1 and np.all(img == 1)
+            gen.close()
+        else:
+            results = list(gen)
+            assert [result[1].id for result in results] == list(range(1, 11))
+            assert all(np.all(result[2] == result[1].id) for result in results)
+        assert len(extracted_mcd_files) > 0
+        assert not any(f.exists() for f in extracted_mcd_files)
+        assert not any(f.parent.exists() for f in extracted_mcd_files)
+
     def test_create_panel_from_imc_panel(self, imc_test_data_steinbock_path: Path):
         imc.create_panel_from_imc_panel(
             imc_test_data_steinbock_path / "raw" / "panel.csv"
@@ -0,0 +1,29 @@
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import pytest
+from steinbock import io
+
+if TYPE_CHECKING:
+    from tensorflow.keras.models import Model  # type: ignore
+
+keras_models_dir = "/opt/keras/models"
+
+
+@pytest.fixture(scope="session")
+def mesmer_model() -> Optional["Model"]:
+    import tensorflow as tf  # type: ignore
+    from tensorflow.keras.models import load_model  # type: ignore
+
+    # allocate GPU memory on demand instead of reserving all of it upfront
+    for gpu in tf.config.list_physical_devices("GPU"):
+        tf.config.experimental.set_memory_growth(gpu, True)
+    model_path = Path(keras_models_dir) / "MultiplexSegmentation"
+    if model_path.exists():
+        return load_model(model_path, compile=False)
+    return None
+
+
+@pytest.fixture(scope="session")
+def imc_img_files(imc_test_data_steinbock_path: Path) -> Tuple[Path, ...]:
+    return tuple(io.list_image_files(imc_test_data_steinbock_path / "img"))
@@ -1,12 +1,61 @@
+import argparse
 import shutil
+import socket
+import sys
+import threading
+import time
 from pathlib import Path
+from types import ModuleType
+from typing import List
 
 import pytest
 from steinbock.segmentation import cellprofiler
+from steinbock.segmentation.cellprofiler import _cellprofiler, _daemon
 
 cellprofiler_binary = "cellprofiler"
 cellprofiler_plugin_dir = "/opt/cellprofiler_plugins"
 
+# records the file list of each invocation and "segments" the listed files
+# by copying them to the output directory
+fake_cellprofiler_script = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) output_dir="$2"; shift ;;
+        --file-list=*) file_list="${1#--file-list=}" ;;
+    esac
+    shift
+done
+echo "$(tr '\\n' ' ' < "$file_list")" >> "$0.calls"
+while read -r file; do cp "$file" "$output_dir/"; done < "$file_list"
+"""
+
+
+@pytest.fixture
+def fake_cellprofiler_binary(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.setattr(_cellprofiler, "cellprofiler_socket", None)
+    fake_cellprofiler_binary = tmp_path / "cellprofiler"
+    fake_cellprofiler_binary.write_text(fake_cellprofiler_script)
+    fake_cellprofiler_binary.chmod(0o755)
+    return fake_cellprofiler_binary
+
+
+def _list_fake_cellprofiler_calls(fake_cellprofiler_binary: Path):
+    calls_file = fake_cellprofiler_binary.with_name("cellprofiler.calls")
+    if not calls_file.exists():
+        return []
+    return [[Path(f) for f in c.split()] for c in calls_file.read_text().splitlines()]
+
+
+def _create_probabilities_dirs(tmp_path: Path, *file_names: List[str]):
+    probabilities_dirs = []
+    for i, dir_file_names in enumerate(file_names):
+        probabilities_dir = tmp_path / f"probabilities{i}"
+        probabilities_dir.mkdir()
+        for file_name in dir_file_names:
+            (probabilities_dir / file_name).write_text(file_name)
+        probabilities_dirs.append(probabilities_dir)
+    return probabilities_dirs
+
 
 class TestCellprofilerSegmentation:
     def test_create_and_save_segmentation_pipeline(self, tmp_path: Path):
@@ -29,3 +78,297 @@ class TestCellprofilerSegmentation:
             tmp_path / "masks",
             cellprofiler_plugin_dir=cellprofiler_plugin_dir,
         )  # TODO
+
+    def test_list_probabilities_files(self, tmp_path: Path):
+        probabilities_dirs = _create_probabilities_dirs(
+            tmp_path, ["b.tiff", "a.tiff", ".hidden.tiff"], ["c.tiff"]
+        )
+        assert _cellprofiler._list_probabilities_files(probabilities_dirs) == [
+            [probabilities_dirs[0] / "a.tiff", probabilities_dirs[0] / "b.tiff"],
+            [probabilities_dirs[1] / "c.tiff"],
+        ]
+        (probabilities_dirs[1] / "a.tiff").write_text("a.tiff")
+        with pytest.raises(
+            cellprofiler.SteinbockCellprofilerSegmentationException,
+            match="Duplicate probabilities file name: a.tiff",
+        ):
+            _cellprofiler._list_probabilities_files(probabilities_dirs)
+
+    @pytest.mark.parametrize(
+        "max_batch_size,expected_calls",
+        [
+            (64, [["a.tiff", "b.tiff", "c.tiff"]]),
+            (1, [["a.tiff", "b.tiff"], ["c.tiff"]]),
+        ],
+    )
+    def test_try_segment_objects_batch(
+        self,
+        fake_cellprofiler_binary: Path,
+        max_batch_size: int,
+        expected_calls: List[List[str]],
+        tmp_path: Path,
+    ):
+        probabilities_dirs = _create_probabilities_dirs(
+            tmp_path, ["a.tiff", "b.tiff"], ["c.tiff"]
+        )
+        mask_dir = tmp_path / "masks"
+        mask_dir.mkdir()
+        results = cellprofiler.try_segment_objects_batch(
+            fake_cellprofiler_binary,
+            tmp_path / "cell_segmentation.cppipe",
+            probabilities_dirs,
+            mask_dir,
+            max_batch_size=max_batch_size,
+        )
+        assert [result.returncode for result in results] == [0] * len(expected_calls)
+        calls = _list_fake_cellprofiler_calls(fake_cellprofiler_binary)
+        assert [[f.name for f in call] for call in calls] == expected_calls
+        assert all(f.is_absolute() for call in calls for f in call)
+        assert sorted(f.name for f in mask_dir.iterdir()) == [
+            "a.tiff",
+            "b.tiff",
+            "c.tiff",
+        ]
+
+    @pytest.mark.parametrize(
+        "num_workers,expected_calls",
+        [
+            (1, [["a.tiff", "b.tiff", "c.tiff", "d.tiff", "e.tiff"]]),
+            (2, [["a.tiff", "c.tiff", "e.tiff"], ["b.tiff", "d.tiff"]]),
+            (8, [["a.tiff"], ["b.tiff"], ["c.tiff"], ["d.tiff"], ["e.tiff"]]),
+        ],
+    )
+    def test_try_segment_objects_parallel(
+        self,
+        fake_cellprofiler_binary: Path,
+        num_workers: int,
+        expected_calls: List[List[str]],
+        tmp_path: Path,
+    ):
+        probabilities_dirs = _create_probabilities_dirs(
+            tmp_path, ["a.tiff", "b.tiff", "c.tiff"], ["d.tiff", "e.tiff"]
+        )
+        mask_dir = tmp_path / "masks"
+        mask_dir.mkdir()
+        results = cellprofiler.try_segment_objects_parallel(
+            fake_cellprofiler_binary,
+            tmp_path / "cell_segmentation.cppipe",
+            probabilities_dirs,
+            mask_dir,
+            num_workers=num_workers,
+        )
+        assert [result.returncode for result in results] == [0] * len(expected_calls)
+        calls = _list_fake_cellprofiler_calls(fake_cellprofiler_binary)
+        assert sorted([f.name for f in call] for call in calls) == expected_calls
+        assert sorted(f.name for f in mask_dir.iterdir()) == [
+            "a.tiff",
+            "b.tiff",
+            "c.tiff",
+            "d.tiff",
+            "e.tiff",
+        ]
+
+
+class TestCellprofilerSegmentationCache:
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, tmp_path: Path, monkeypatch) -> Path:
+        cache_dir = tmp_path / "cache" / "cellprofiler_masks"
+        monkeypatch.setattr(_cellprofiler, "cellprofiler_cache_dir", cache_dir)
+        return cache_dir
+
+    @pytest.fixture
+    def segmentation_pipeline_file(self, tmp_path: Path) -> Path:
+        segmentation_pipeline_file = tmp_path / "cell_segmentation.cppipe"
+        cellprofiler.create_and_save_segmentation_pipeline(segmentation_pipeline_file)
+        return segmentation_pipeline_file
+
+    def _segment(self, fake_cellprofiler_binary, segmentation_pipeline_file, tmp_path):
+        mask_dir = tmp_path / "masks"
+        mask_dir.mkdir(exist_ok=True)
+        results = cellprofiler.try_segment_objects_batch(
+            fake_cellprofiler_binary,
+            segmentation_pipeline_file,
+            [tmp_path / "probabilities0"],
+            mask_dir,
+            use_cache=True,
+        )
+        assert [result.returncode for result in results] == [0]
+        return mask_dir
+
+    def test_cache_miss_and_hit(
+        self,
+        fake_cellprofiler_binary: Path,
+        segmentation_pipeline_file: Path,
+        cache_dir: Path,
+        tmp_path: Path,
+    ):
+        _create_probabilities_dirs(tmp_path, ["a.tiff", "b.tiff"])
+        mask_dir = self._segment(
+            fake_cellprofiler_binary, segmentation_pipeline_file, tmp_path
+        )
+        assert len(_list_fake_cellprofiler_calls(fake_cellprofiler_binary)) == 1
+        assert sorted(f.name for f in cache_dir.rglob("*.tiff")) == [
+            "a.tiff",
+            "b.tiff",
+        ]
+        shutil.rmtree(mask_dir)
+        mask_dir = self._segment(
+            fake_cellprofiler_binary, segmentation_pipeline_file, tmp_path
+        )
+        assert len(_list_fake_cellprofiler_calls(fake_cellprofiler_binary)) == 1
+        assert (mask_dir / "a.tiff").read_text() == "a.tiff"
+        assert (mask_dir / "b.tiff").read_text() == "b.tiff"
+        (tmp_path / "probabilities0" / "b.tiff").write_text("changed")
+        mask_dir = self._segment(
+            fake_cellprofiler_binary, segmentation_pipeline_file, tmp_path
+        )
+        assert len(_list_fake_cellprofiler_calls(fake_cellprofiler_binary)) == 2
+        assert (mask_dir / "b.tiff").read_text() == "changed"
+
+    def test_cache_write_failure(
+        self,
+        fake_cellprofiler_binary: Path,
+        segmentation_pipeline_file: Path,
+        cache_dir: Path,
+        tmp_path: Path,
+        caplog,
+    ):
+        cache_dir.parent.write_text("not a directory")
+        _create_probabilities_dirs(tmp_path, ["a.tiff"])
+        mask_dir = self._segment(
+            fake_cellprofiler_binary, segmentation_pipeline_file, tmp_path
+        )
+        assert (mask_dir / "a.tiff").read_text() == "a.tiff"
+        assert "Error caching masks" in caplog.text
+
+
+class TestCellprofilerDaemon:
+    @pytest.fixture
+    def fake_cellprofiler(self, monkeypatch):
+        # minimal stand-in for the CellProfiler modules used by the daemon
+        preferences = ModuleType("cellprofiler_core.preferences")
+        preferences_state = {
+            "image_directory": "/default/images",
+            "output_directory": "/default/output",
+            "image_set_file": None,
+        }
+        for name in preferences_state:
+            getter_name = "get_" + ("" if name == "image_set_file" else "default_")
+            getter_name += name
+            setter_name = "set" + getter_name[3:]
+            setattr(preferences, getter_name, lambda n=name: preferences_state[n])
+            setattr(
+                preferences,
+                setter_name,
+                lambda value, n=name: preferences_state.__setitem__(n, value),
+            )
+        preferences.set_headless = lambda: None
+        preferences.set_plugin_directory = lambda *args, **kwargs: None
+        java = ModuleType("cellprofiler_core.utilities.java")
+        java.start_java = lambda: None
+        java.stop_java = lambda: None
+        main = ModuleType("cellprofiler.__main__")
+        parser = argparse.ArgumentParser()
+        parser.add_argument("-c", action="store_true")
+        parser.add_argument("-r", action="store_true")
+        parser.add_argument("-p", dest="pipeline_filename")
+        parser.add_argument("-i", dest="image_directory")
+        parser.add_argument("-o", dest="output_directory")
+        parser.add_argument("--file-list", dest="image_set_file")
+        jobs = []
+
+        def run_pipeline_headless(options, args):
+            jobs.append(dict(preferences_state))
+            return 0 if options.pipeline_filename == "ok.cppipe" else 2
+
+        main.parse_args = lambda args: (parser.parse_args(args[1:]), [])
+        main.run_pipeline_headless = run_pipeline_headless
+        for module in (preferences, java, main):
+            monkeypatch.setitem(sys.modules, module.__name__, module)
+        return preferences_state, jobs
+
+    @staticmethod
+    def _start_serving(cellprofiler_socket: Path) -> threading.Thread:
+        thread = threading.Thread(target=_daemon.serve, args=(cellprofiler_socket,))
+        thread.start()
+        while not cellprofiler_socket.exists():
+            time.sleep(0.01)
+        return thread
+
+    def test_serve(self, fake_cellprofiler, tmp_path: Path):
+        preferences_state, jobs = fake_cellprofiler
+        cellprofiler_socket = tmp_path / "cellprofiler.sock"
+        thread = self._start_serving(cellprofiler_socket)
+        try:
+            assert _daemon.is_running(cellprofiler_socket)
+            args = ["cellprofiler", "-c", "-r", "-p", "ok.cppipe"]
+            file_list_args = args + ["-o", str(tmp_path / "masks1")]
+            file_list_args.append(f"--file-list={tmp_path / 'file_list.txt'}")
+            assert _daemon.submit_job(cellprofiler_socket, file_list_args) == 0
+            image_dir_args = ["cellprofiler", "-c", "-r", "-p", "fail.cppipe"]
+            image_dir_args += ["-i", str(tmp_path), "-o", str(tmp_path / "masks2")]
+            assert _daemon.submit_job(cellprofiler_socket, image_dir_args) == 2
+        finally:
+            _daemon.stop(cellprofiler_socket)
+            thread.join()
+        assert not cellprofiler_socket.exists()
+        assert jobs == [
+            {
+                "image_directory": "/default/images",
+                "output_directory": str(tmp_path / "masks1"),
+                "image_set_file": str(tmp_path / "file_list.txt"),
+            },
+            {
+                "image_directory": str(tmp_path),
+                "output_directory": str(tmp_path / "masks2"),
+                "image_set_file": None,
+            },
+        ]
+        assert (tmp_path / "masks1").is_dir() and (tmp_path / "masks2").is_dir()
+        assert preferences_state == {
+            "image_directory": "/default/images",
+            "output_directory": "/default/output",
+            "image_set_file": None,
+        }
+
+    def test_stale_socket(self, fake_cellprofiler, monkeypatch, tmp_path: Path):
+        cellprofiler_socket = tmp_path / "cellprofiler.sock"
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.bind(str(cellprofiler_socket))  # bound, but never listening
+        assert not _daemon.is_running(cellprofiler_socket)
+        monkeypatch.setattr(
+            _cellprofiler, "cellprofiler_socket", str(cellprofiler_socket)
+        )
+        monkeypatch.setattr(
+            _cellprofiler, "run_captured", lambda args: f"ran {args[0]}"
+        )
+        assert _cellprofiler._run_cellprofiler(["cellprofiler"]) == "ran cellprofiler"
+        with pytest.raises(cellprofiler.SteinbockCellprofilerSegmentationException):
+            cellprofiler.stop_daemon(cellprofiler_socket)
+        assert not cellprofiler_socket.exists()
+
+    def test_dead_daemon(self, monkeypatch, tmp_path: Path):
+        cellprofiler_socket = tmp_path / "cellprofiler.sock"
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(cellprofiler_socket))
+        server.listen()
+
+        def accept_and_die():
+            conn, _ = server.accept()
+            with conn, conn.makefile(mode="rb") as f:
+                f.readline()  # the daemon dies while running the job
+
+        thread = threading.Thread(target=accept_and_die)
+        thread.start()
+        monkeypatch.setattr(
+            _cellprofiler, "cellprofiler_socket", str(cellprofiler_socket)
+        )
+        try:
+            with pytest.raises(
+                cellprofiler.SteinbockCellprofilerSegmentationException,
+                match="CellProfiler daemon failed",
+            ):
+                _cellprofiler._run_cellprofiler(["cellprofiler"])
+        finally:
+            thread.join()
+            server.close()
@@ -2,30 +2,104 @@ from pathlib import Path
 
 import numpy as np
 import pytest
-from steinbock import io
 from steinbock.segmentation import deepcell
 from steinbock.segmentation.deepcell import Application
 
-keras_models_dir = "/opt/keras/models"
+mesmer_channel_groups = np.array([np.nan, 2, np.nan, np.nan, 1], dtype=np.float32)
 
 
 @pytest.mark.skipif(not deepcell.deepcell_available, reason="DeepCell is not available")
 class TestDeepcellSegmentation:
     @pytest.mark.skip(reason="Test would take too long")
     @pytest.mark.filterwarnings("ignore::DeprecationWarning")
-    def test_try_segment_objects_mesmer(self, imc_test_data_steinbock_path: Path):
-        from tensorflow.keras.models import load_model  # type: ignore
-
-        img_files = io.list_image_files(imc_test_data_steinbock_path / "img")
-        model = None
-        model_path = Path(keras_models_dir) / "MultiplexSegmentation"
-        if model_path.exists():
-            model = load_model(model_path, compile=False)
-        channel_groups = np.array([np.nan, 2, np.nan, np.nan, 1])
+    def test_try_segment_objects_mesmer(self, imc_img_files, mesmer_model):
         deepcell.try_segment_objects(
-            img_files,
+            imc_img_files,
             Application.MESMER,
-            model=model,
+            model=mesmer_model,
             channelwise_minmax=True,
-            channel_groups=channel_groups,
+            channel_groups=mesmer_channel_groups,
         )  # TODO
+
+
+class TestDeepcellSegmentationStack:
+    @pytest.mark.parametrize("dtype", [np.float32, np.float64, np.uint8, np.uint16])
+    def test_aggregate_channel_groups(self, dtype):
+        rng = np.random.default_rng(seed=0)
+        img = rng.integers(0, 200, size=(5, 8, 6)).astype(dtype)
+        group_img = deepcell._aggregate_channel_groups(img, mesmer_channel_groups)
+        expected_group_img = np.stack(
+            [
+                np.mean(img[mesmer_channel_groups == 1], axis=0),
+                np.mean(img[mesmer_channel_groups == 2], axis=0),
+            ]
+        )
+        assert np.allclose(group_img, expected_group_img)
+
+    def test_aggregate_channel_groups_nan(self):
+        img = np.ones((5, 8, 6), dtype=np.float32)
+        img[4, 0, 0] = np.nan
+        group_img = deepcell._aggregate_channel_groups(img, mesmer_channel_groups)
+        assert np.isnan(group_img[0, 0, 0])
+        assert np.all(group_img[1] == 1)
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+    @pytest.mark.parametrize(
+        "channelwise_minmax,channelwise_zscore",
+        [(True, False), (False, True), (True, True)],
+    )
+    def test_normalize_integer_channels(
+        self, dtype, channelwise_minmax, channelwise_zscore
+    ):
+        rng = np.random.default_rng(seed=0)
+        img = rng.integers(0, 200, size=(3, 8, 6)).astype(dtype)
+        img[2] = 7  # constant channel
+        normalized_img = deepcell._normalize_integer_channels(
+            img,
+            channelwise_minmax=channelwise_minmax,
+            channelwise_zscore=channelwise_zscore,
+        )
+        expected_normalized_img = deepcell.create_segmentation_stack(
+            img.astype(np.float32),
+            channelwise_minmax=channelwise_minmax,
+            channelwise_zscore=channelwise_zscore,
+        )
+        assert normalized_img.dtype == np.float32
+        assert np.allclose(normalized_img, expected_normalized_img, atol=1e-5)
+
+
+@pytest.mark.skipif(
+    not deepcell.onnxruntime_available, reason="ONNX Runtime is not available"
+)
+class TestOnnxModel:
+    def test_predict(self, tmp_path: Path):
+        import onnx
+        from onnx import TensorProto, helper
+
+        model_file = tmp_path / "model.onnx"
+        x = helper.make_tensor_value_info("x", TensorProto.FLOAT, ["N", 4, 4, 2])
+        y = helper.make_tensor_value_info("y", TensorProto.FLOAT, ["N", 4, 4, 2])
+        z = helper.make_tensor_value_info("z", TensorProto.FLOAT, ["N", 4, 4, 2])
+        graph = helper.make_graph(
+            [
+                helper.make_node("Relu", ["x"], ["y"]),
+                helper.make_node("Neg", ["x"], ["z"]),
+            ],
+            "test",
+            [x],
+            [y, z],
+        )
+        model = helper.make_model(
+            graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8
+        )
+        onnx.save(model, model_file)
+        onnx_model = deepcell.OnnxModel(model_file, providers=["CPUExecutionProvider"])
+        assert onnx_model.input_shape == (None, 4, 4, 2)
+        assert onnx_model.output_names == ["y", "z"]
+        assert onnx_model.providers == ["CPUExecutionProvider"]
+        assert deepcell._get_default_batch_size(onnx_model) == 1
+        img = np.random.default_rng(seed=0).normal(size=(3, 4, 4, 2))
+        relu_img, neg_img = onnx_model.predict(img, batch_size=3)
+        assert relu_img.dtype == np.float32
+        assert np.allclose(relu_img, np.maximum(img, 0))
+        assert np.allclose(neg_img, -img)
@@ -1,5 +1,6 @@
 from pathlib import Path
 
+import pytest
 from steinbock import io
 
 
@@ -59,3 +60,10 @@ class TestIO:
 
     def test_write_neighbors(self, imc_test_data_steinbock_path: Path):
         pass  # TODO
+
+    def test_check_tiff_compression(self):
+        assert io._check_tiff_compression(None) is None
+        assert io._check_tiff_compression("") is None
+        assert io._check_tiff_compression("zlib") == "zlib"
+        with pytest.raises(io.SteinbockIOException):
+            io._check_tiff_compression("invalid")